@@ -0,0 +1,366 @@
+import argparse
+import concurrent.futures
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# benchmarks of the storage layers and of the MapReduce pipeline on the synthetic datasets of the notebooks
+# every case runs in a new process inside its own temporary directory, so its peak RSS and its caches are its own
+#   python Benchmark.py --files 2000 --output results.json
+#   python Benchmark.py --files 2000 --baseline results.json   (exit code 1 on a regression)
+# results: throughput (ops/s, MB/s), latency percentiles of single operations (ms) and peak RSS of the case's process,
+# each the median over the repetitions of the case after its warm-up runs
+
+firstname  = ['John', 'Dana', 'Scott', 'Marc', 'Steven', 'Michael', 'Albert', 'Johanna']
+city       = ['NewYork', 'Haifa', 'Munchen', 'London', 'PaloAlto',  'TelAviv', 'Kiel', 'Hamburg']
+secondname = ['Smith', 'Brown', 'Miller', 'Watson', 'Bain']
+
+def get_input_filename(i:int):
+    return "my_input_file_{:05d}.csv".format(i)
+
+def map_output_filename(threadID: int):
+    from MapReduceEngine import MapReduceEngine
+    return MapReduceEngine.scratch_name("map-output-{}.csv".format(threadID))
+
+# the inverted index job of MapReduceBigFiles.ipynb
+def read_df_from_csv(filename:str, delete:bool, header:bool):
+    from VirtualBigFile import VirtualBigFile
+    bigFile = VirtualBigFile(filename)
+    tuples  = bigFile.readData(type_=[tuple])
+    if delete:
+        bigFile.delete()
+    return pd.DataFrame(tuples[1:],columns=tuples[0]) if header else pd.DataFrame(tuples)
+
+def combine_documents(value, documents):
+    return set(documents)
+
+def map_process(threadID, input_filenames):
+    from VirtualBigFile import VirtualBigFile
+    from MapReduceEngine import MapReduceEngine
+    pairs = []
+    for filename in input_filenames:
+        data = read_df_from_csv(filename, delete=False,header=True)
+        for col in data.columns:
+            pairs.extend([(col + '_' + value, filename) for value in data[col].values])
+    tuples = [('key', 'value')] + MapReduceEngine.combine(pairs, combine_documents)
+    outputFile = VirtualBigFile(map_output_filename(threadID))
+    outputFile.delete()
+    outputFile.append(tuples)
+    outputFile.flush()
+
+def shuffle_read_temp_from_input(threadID):
+    return read_df_from_csv(map_output_filename(threadID),delete=True,header=True)
+
+def reduce_process(threadID, shuffle_rows):
+    from VirtualBigFile import VirtualBigFile
+    tuples = []
+    for shuffle_row in shuffle_rows:
+        value, documents = shuffle_row[0], shuffle_row[1]
+        docs = sorted(list(set(documents.split(','))))
+        tuples.append((value, ':'.join(docs)))
+    outputFile = VirtualBigFile("part-{}-final.csv".format(threadID))
+    outputFile.delete()
+    outputFile.append(tuples)
+    outputFile.flush()
+
+class Benchmark:
+    '''Benchmark cases, each one a function of the scale returning its timings'''
+    cases = ("storage_write", "storage_read_cold", "storage_read_hot", "storage_scan", "vbf_append", "vbf_read",
+             "sfc_create", "sfc_read", "mapreduce")
+    # a case regressed when its median is slower (throughput, p99 latency) or bigger (peak RSS) than the baseline's by more than this
+    defaultTolerance = 0.2
+    defaultRepeat    = 5
+    defaultWarmup    = 1
+
+    def createDatasets(num_files, rows_in_file, seed=0):
+        # [(file name, csv text)] like createDatasets of the notebooks, the same for the same seed
+        random    = np.random.RandomState(seed)
+        datasets  = []
+        for i in range(num_files):
+            first     = random.choice(a=firstname,  size=rows_in_file)
+            cit       = random.choice(a=city,       size=rows_in_file)
+            second    = random.choice(a=secondname, size=rows_in_file)
+            df        = pd.DataFrame({'firstname': first, 'city': cit, 'secondname': second})
+            datasets.append((get_input_filename(i), df.to_csv(index=False, header=True)))
+        return datasets
+
+    def timeOps(items, function):
+        # (total seconds, latency of each call in seconds)
+        latencies = []
+        start     = time.perf_counter()
+        for item in items:
+            op_start = time.perf_counter()
+            function(item)
+            latencies.append(time.perf_counter() - op_start)
+        return time.perf_counter() - start, latencies
+
+    def result(seconds, ops, bytes_, latencies, **extra):
+        res = {"seconds": seconds, "ops": ops, "bytes": bytes_,
+               "ops_per_sec": ops / seconds if seconds > 0 else None,
+               "mb_per_sec": bytes_ / seconds / 2**20 if seconds > 0 else None,
+               "latency_ms": Benchmark.percentiles(latencies)}
+        res.update(extra)
+        return res
+
+    def percentiles(latencies):
+        if len(latencies) < 1:
+            return None
+        latencies = sorted(latencies)
+        def rank(p):
+            return 1000.0 * latencies[min(int(p * len(latencies)), len(latencies) - 1)]
+        return {"p50": rank(0.5), "p90": rank(0.9), "p99": rank(0.99), "max": 1000.0 * latencies[-1]}
+
+    def median(values):
+        values = [value for value in values if value is not None]
+        return float(np.median(values)) if len(values) > 0 else None
+
+    def summarize(repetitions):
+        # the median of each metric over the repetitions, the other fields are those of the repetition with the median time
+        ordered   = sorted(repetitions, key=lambda rep: rep["seconds"])
+        res       = dict(ordered[(len(ordered) - 1) // 2])
+        for metric in ("seconds", "ops_per_sec", "mb_per_sec", "peak_rss_bytes"):
+            res[metric] = Benchmark.median([rep.get(metric) for rep in repetitions])
+        latencies = [rep["latency_ms"] for rep in repetitions if rep.get("latency_ms") is not None]
+        if len(latencies) > 0:
+            res["latency_ms"] = {p: Benchmark.median([latency[p] for latency in latencies]) for p in latencies[0]}
+        res["repetitions"] = [{"seconds": rep["seconds"], "ops_per_sec": rep.get("ops_per_sec"),
+                               "p99_ms": (rep.get("latency_ms") or {}).get("p99"), "peak_rss_bytes": rep.get("peak_rss_bytes")}
+                              for rep in repetitions]
+        return res
+
+    def peakRSS():
+        # bytes, None where the resource module does not exist (Windows)
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+    # cases: the datasets are written before the timer starts unless writing them is what is measured
+
+    def storage_write(datasets, scale):
+        from MockObjectStorage import MockObjectStorage
+        storage = MockObjectStorage()
+        start   = time.perf_counter()
+        seconds, latencies = Benchmark.timeOps(datasets, lambda item: storage.createObject(item[0], item[1]))
+        storage.flush()
+        seconds = time.perf_counter() - start
+        return Benchmark.result(seconds, len(datasets), sum(len(data) for _, data in datasets), latencies)
+
+    def storage_read_cold(datasets, scale):
+        from MockObjectStorage import MockObjectStorage
+        MockObjectStorage(MaxCachedFiles=0).createObject([name for name, _ in datasets], [data for _, data in datasets])
+        storage = MockObjectStorage()
+        seconds, latencies = Benchmark.timeOps(datasets, lambda item: storage.readObject(item[0], type_=[tuple]))
+        return Benchmark.result(seconds, len(datasets), sum(len(data) for _, data in datasets), latencies,
+                                storage=storage.stats())
+
+    def storage_read_hot(datasets, scale):
+        # skewed reads of a working set which fits the cache
+        from MockObjectStorage import MockObjectStorage
+        MockObjectStorage(MaxCachedFiles=0).createObject([name for name, _ in datasets], [data for _, data in datasets])
+        storage = MockObjectStorage()
+        random  = np.random.RandomState(scale["seed"])
+        working = min(storage.MaxCachedFiles // 2, len(datasets))
+        reads   = [datasets[ind] for ind in random.zipf(1.5, size=len(datasets)) % working]
+        seconds, latencies = Benchmark.timeOps(reads, lambda item: storage.readObject(item[0], type_=[tuple]))
+        stats   = storage.stats()
+        return Benchmark.result(seconds, len(reads), sum(len(data) for _, data in reads), latencies,
+                                storage=stats, hit_rate=stats["hits"] / max(stats["hits"] + stats["misses"], 1))
+
+    def storage_scan(datasets, scale):
+        # repeated sequential scans of twice the cache capacity, the pattern which defeats an lru cache
+        from MockObjectStorage import MockObjectStorage
+        MockObjectStorage(MaxCachedFiles=0).createObject([name for name, _ in datasets], [data for _, data in datasets])
+        storage = MockObjectStorage(Policy=scale["policy"])
+        scanned = datasets[:(2 * storage.MaxCachedFiles)] * 4
+        seconds, latencies = Benchmark.timeOps(scanned, lambda item: storage.readObject(item[0]))
+        stats   = storage.stats()
+        return Benchmark.result(seconds, len(scanned), sum(len(data) for _, data in scanned), latencies,
+                                storage=stats, hit_rate=stats["hits"] / max(stats["hits"] + stats["misses"], 1))
+
+    def vbf_append(datasets, scale):
+        from VirtualBigFile import VirtualBigFile, objectStorage
+        def write(item):
+            bigFile = VirtualBigFile(item[0])
+            bigFile.delete()
+            bigFile.append(item[1])
+            bigFile.flush()
+        start   = time.perf_counter()
+        seconds, latencies = Benchmark.timeOps(datasets, write)
+        objectStorage.flush()
+        seconds = time.perf_counter() - start
+        return Benchmark.result(seconds, len(datasets), sum(len(data) for _, data in datasets), latencies)
+
+    def vbf_read(datasets, scale):
+        from VirtualBigFile import VirtualBigFile, objectStorage
+        VirtualBigFile.writeFiles(dict(datasets))
+        objectStorage.clearCache()
+        seconds, latencies = Benchmark.timeOps(datasets, lambda item: VirtualBigFile(item[0]).readData(type_=[tuple]))
+        return Benchmark.result(seconds, len(datasets), sum(len(data) for _, data in datasets), latencies,
+                                storage=objectStorage.stats())
+
+    def sfc_create(datasets, scale):
+        from SmallFilesContainer import SmallFilesContainer
+        container = SmallFilesContainer("BenchmarkSmallFiles.csv")
+        start     = time.perf_counter()
+        seconds, latencies = Benchmark.timeOps(datasets, lambda item: container.createNewFile(item[0], item[1], deleteExist=True))
+        container.flush(objectStorageFlush=True)
+        seconds   = time.perf_counter() - start
+        return Benchmark.result(seconds, len(datasets), sum(len(data) for _, data in datasets), latencies)
+
+    def sfc_read(datasets, scale):
+        from SmallFilesContainer import SmallFilesContainer
+        from VirtualBigFile import objectStorage
+        container = SmallFilesContainer("BenchmarkSmallFiles.csv")
+        container.appendMany(dict(datasets))
+        container.flush(objectStorageFlush=True)
+        objectStorage.clearCache()
+        container = SmallFilesContainer("BenchmarkSmallFiles.csv")
+        seconds, latencies = Benchmark.timeOps(datasets, lambda item: container.readFile(item[0], type_=[tuple]))
+        return Benchmark.result(seconds, len(datasets), sum(len(data) for _, data in datasets), latencies,
+                                storage=objectStorage.stats())
+
+    def mapreduce(datasets, scale):
+        # end to end inverted index, latencies are the durations of the map and reduce tasks
+        from VirtualBigFile import VirtualBigFile, objectStorage
+        from MapReduceEngine import MapReduceEngine, logger
+        VirtualBigFile.writeFiles(dict(datasets))
+        objectStorage.flush()
+        logger.setLevel(logging.WARNING)
+        filenames = [name for name, _ in datasets]
+        start     = time.perf_counter()
+        metrics   = MapReduceEngine.execute(filenames, map_process, shuffle_read_temp_from_input, reduce_process,
+                                            max_threads=scale["threads"], executor=scale["executor"],
+                                            combiner_creator=combine_documents)
+        objectStorage.flush()
+        seconds   = time.perf_counter() - start
+        latencies = [task["end"] - task["start"] for task in metrics.tasks]
+        stages    = {stage["name"]: stage["seconds"] for stage in metrics.stages}
+        return Benchmark.result(seconds, len(datasets), sum(len(data) for _, data in datasets), latencies,
+                                stages=stages, counters=metrics.counters)
+
+    def runCase(case, scale):
+        # runs one case in a new temporary directory, in the calling process
+        workdir = tempfile.mkdtemp(prefix="benchmark-{}-".format(case))
+        cwd     = os.getcwd()
+        os.chdir(workdir)
+        try:
+            datasets = Benchmark.createDatasets(scale["files"], scale["rows"], scale["seed"])
+            res      = getattr(Benchmark, case)(datasets, scale)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(workdir, ignore_errors=True)
+        res["peak_rss_bytes"] = Benchmark.peakRSS()
+        return res
+
+    def run(cases=None, files=1000, rows=10, seed=0, threads=8, executor="threads", policy="lru", isolate=True,
+            repeat=None, warmup=None):
+        # machine readable results of the cases, isolate runs each repetition of a case in a new process
+        # repeat: timed runs of each case summarized by their median, after warmup runs which are not counted
+        cases   = cases if cases is not None else Benchmark.cases
+        repeat  = repeat if repeat is not None else Benchmark.defaultRepeat
+        warmup  = warmup if warmup is not None else Benchmark.defaultWarmup
+        assert repeat > 0 and warmup >= 0
+        scale   = {"files": files, "rows": rows, "seed": seed, "threads": threads, "executor": executor, "policy": policy}
+        results = {}
+        for case in cases:
+            assert case in Benchmark.cases, "Unknown case: {}".format(case)
+            repetitions = []
+            for _ in range(warmup + repeat):
+                if isolate:
+                    context = multiprocessing.get_context("spawn")
+                    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                        repetitions.append(pool.submit(Benchmark.runCase, case, scale).result())
+                else:
+                    repetitions.append(Benchmark.runCase(case, scale))
+            results[case] = Benchmark.summarize(repetitions[warmup:])
+        return {"version": 2, "time": time.time(), "python": platform.python_version(), "platform": platform.platform(),
+                "cpus": os.cpu_count(), "scale": scale, "repeat": repeat, "warmup": warmup, "results": results}
+
+    def compare(results, baseline, tolerance=None):
+        # regressions of results against the baseline: [(case, metric, baseline value, value)]
+        tolerance   = tolerance if tolerance is not None else Benchmark.defaultTolerance
+        regressions = []
+        if baseline.get("scale") != results.get("scale"):
+            logging.getLogger("Benchmark").warning("Baseline scale {} differs from {}".format(baseline.get("scale"),results.get("scale")))
+        if baseline.get("repeat", 1) < 2:
+            logging.getLogger("Benchmark").warning("Baseline timings are single runs, not medians over repetitions")
+        for case, res in results["results"].items():
+            base = baseline["results"].get(case)
+            if base is None:
+                continue
+            checks = [("ops_per_sec", base.get("ops_per_sec"), res.get("ops_per_sec"), True),
+                      ("p99_ms", (base.get("latency_ms") or {}).get("p99"), (res.get("latency_ms") or {}).get("p99"), False),
+                      ("peak_rss_bytes", base.get("peak_rss_bytes"), res.get("peak_rss_bytes"), False)]
+            for metric, base_value, value, higher_is_better in checks:
+                if base_value is None or value is None or base_value <= 0:
+                    continue
+                if higher_is_better and value < base_value * (1 - tolerance) or\
+                   not higher_is_better and value > base_value * (1 + tolerance):
+                    regressions.append((case, metric, base_value, value))
+        return regressions
+
+    def report(results, baseline=None):
+        # one line per case, with the change against the baseline
+        lines = ["{:<18} {:>10} {:>10} {:>9} {:>9} {:>9} {:>9}".format("case", "ops/s", "MB/s", "p50 ms", "p99 ms", "RSS MB", "vs base")]
+        for case, res in results["results"].items():
+            latency = res.get("latency_ms") or {}
+            change  = ""
+            if baseline is not None and case in baseline["results"] and baseline["results"][case].get("ops_per_sec"):
+                change = "{:+.1%}".format(res["ops_per_sec"] / baseline["results"][case]["ops_per_sec"] - 1)
+            rss     = res.get("peak_rss_bytes")
+            lines.append("{:<18} {:>10.1f} {:>10.2f} {:>9.3f} {:>9.3f} {:>9} {:>9}".format(
+                case, res["ops_per_sec"] or 0, res["mb_per_sec"] or 0, latency.get("p50",0), latency.get("p99",0),
+                "{:.1f}".format(rss / 2**20) if rss is not None else "-", change))
+        return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of MockObjectStorage, VirtualBigFile, SmallFilesContainer and MapReduceEngine")
+    parser.add_argument("--cases", nargs="+", choices=Benchmark.cases, help="cases to run (default all)")
+    parser.add_argument("--files", type=int, default=1000, help="input files of the synthetic dataset")
+    parser.add_argument("--rows", type=int, default=10, help="rows in each input file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threads", type=int, default=8, help="max_threads of the mapreduce case")
+    parser.add_argument("--executor", default="threads", help="executor of the mapreduce case")
+    parser.add_argument("--policy", default="lru", help="cache policy of the storage_scan case")
+    parser.add_argument("--output", help="JSON file getting the results")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=Benchmark.defaultTolerance,
+                        help="relative change counted as a regression (default %(default)s)")
+    parser.add_argument("--repeat", type=int, default=Benchmark.defaultRepeat,
+                        help="timed runs of each case, compared by their median (default %(default)s)")
+    parser.add_argument("--warmup", type=int, default=Benchmark.defaultWarmup,
+                        help="runs of each case before the timed ones, not counted (default %(default)s)")
+    parser.add_argument("--no-isolate", action="store_true", help="run all cases in this process")
+    args    = parser.parse_args(argv)
+    results = Benchmark.run(args.cases, args.files, args.rows, args.seed, args.threads, args.executor, args.policy,
+                            isolate=not args.no_isolate, repeat=args.repeat, warmup=args.warmup)
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print(Benchmark.report(results, baseline))
+    if args.output is not None:
+        with open(args.output,"w") as f:
+            json.dump(results, f, indent=1)
+    if baseline is not None:
+        regressions = Benchmark.compare(results, baseline, args.tolerance)
+        for case, metric, base_value, value in regressions:
+            print("REGRESSION {} {}: {:.4g} --> {:.4g}".format(case, metric, base_value, value))
+        return 1 if len(regressions) > 0 else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+from collections import OrderedDict
+from array import array
+import zlib
+
+# eviction policies of a MockObjectStorage cache shard
+# a policy only orders names, the shard keeps the data and calls the policy under its lock:
+#   insert(name)          - name was added into the shard
+#   touch(name)           - cache hit of name
+#   remove(name)          - name was removed by the shard (deleted or dropped)
+#   victim(newest) -> name to evict, newest is the name inserted last (TinyLFU may reject it)
+
+class LRUPolicy:
+    '''Least recently used'''
+    def __init__(self):
+        self.order = OrderedDict() # oldest first
+
+    def insert(self, name):
+        self.order[name] = None
+
+    def touch(self, name):
+        self.order.move_to_end(name)
+
+    def remove(self, name):
+        self.order.pop(name,None)
+
+    def victim(self, newest=None):
+        return self.order.popitem(last=False)[0]
+
+class TwoQueuePolicy:
+    '''2Q: objects read once stay in a FIFO probation queue and only a second hit promotes them
+    into the protected LRU queue, so a sequential scan of partitions does not flush the hot objects.
+    Names recently evicted from probation are remembered (ghosts) and go directly to the protected queue.'''
+    probationRatio = 0.25
+    ghostRatio     = 2
+
+    def __init__(self):
+        self.probation = OrderedDict() # FIFO, oldest first
+        self.protected = OrderedDict() # LRU, oldest first
+        self.ghosts    = OrderedDict() # names only, oldest first
+
+    def insert(self, name):
+        if name in self.ghosts:
+            del self.ghosts[name]
+            self.protected[name] = None
+        else:
+            self.probation[name] = None
+
+    def touch(self, name):
+        if name in self.protected:
+            self.protected.move_to_end(name)
+            return
+        del self.probation[name]
+        self.protected[name] = None
+
+    def remove(self, name):
+        if name in self.probation:
+            del self.probation[name]
+        else:
+            self.protected.pop(name,None)
+
+    def victim(self, newest=None):
+        num_resident = len(self.probation) + len(self.protected)
+        if len(self.probation) > 0 and (len(self.probation) > self.probationRatio*num_resident or len(self.protected) < 1):
+            name = self.probation.popitem(last=False)[0]
+            self.ghosts[name] = None
+            while len(self.ghosts) > max(self.ghostRatio*num_resident,16):
+                self.ghosts.popitem(last=False)
+            return name
+        return self.protected.popitem(last=False)[0]
+
+class TinyLFUPolicy(LRUPolicy):
+    '''LRU with TinyLFU admission: a count-min sketch estimates how often each name was accessed lately
+    and a new object replaces the LRU victim only if it is more popular, otherwise the new object is evicted'''
+    sketchDepth = 4
+    sketchWidth = 4096
+
+    def __init__(self):
+        LRUPolicy.__init__(self)
+        self.counters   = [array('H',bytes(2*self.sketchWidth)) for _ in range(self.sketchDepth)]
+        self.additions  = 0
+        self.sampleSize = 10*self.sketchWidth
+
+    def slots(self, name):
+        # double hashing: one independent slot per row out of two hash values
+        data  = name.encode()
+        hash1 = zlib.crc32(data)
+        hash2 = zlib.adler32(data) | 1
+        return [(hash1 + row*hash2) % self.sketchWidth for row in range(self.sketchDepth)]
+
+    def record(self, name):
+        for row, slot in zip(self.counters, self.slots(name)):
+            if row[slot] < 0xFFFF:
+                row[slot] += 1
+        self.additions += 1
+        if self.additions >= self.sampleSize:
+            # aging: halving all counters keeps the sketch biased towards recent accesses
+            for row in self.counters:
+                for slot in range(self.sketchWidth):
+                    row[slot] >>= 1
+            self.additions //= 2
+
+    def frequency(self, name):
+        return min(row[slot] for row, slot in zip(self.counters, self.slots(name)))
+
+    def insert(self, name):
+        self.record(name)
+        LRUPolicy.insert(self, name)
+
+    def touch(self, name):
+        self.record(name)
+        LRUPolicy.touch(self, name)
+
+    def victim(self, newest=None):
+        victim = next(iter(self.order))
+        if newest is not None and newest != victim and newest in self.order and\
+        self.frequency(newest) <= self.frequency(victim):
+            victim = newest
+        del self.order[victim]
+        return victim
+
+policies = {"lru": LRUPolicy, "2q": TwoQueuePolicy, "tinylfu": TinyLFUPolicy}
@@ -0,0 +1,136 @@
+from array import array
+import struct
+try:
+    import numpy as np
+    import pandas as pd
+except ImportError:
+    np = None
+    pd = None
+
+# binary columnar blocks for VirtualBigFile partitions
+# block: header | column 0 | column 1 | ...
+#   header: magic, total block length in bytes, number of rows, number of columns
+#   column: type code, payload length, payload
+#     'q' int64, 'd' float64: the values as a little endian array
+#     's' str: num_rows+1 uint32 offsets into the utf-8 encoded strings that follow them
+# a block is decoded by itself, partitions always hold whole blocks
+
+MAGIC         = b'VBC1'
+HEADER        = struct.Struct('<4sQIH')
+COLUMN_HEADER = struct.Struct('<cQ')
+TYPES         = ('q', 'd', 's')
+
+class ColumnarFormat:
+
+    def inferSchema(data):
+        # [(column name, type code)] from a DataFrame or from the first tuple of a list
+        if pd is not None and isinstance(data,pd.DataFrame):
+            schema = []
+            for name, dtype in zip(data.columns, data.dtypes):
+                if dtype.kind in 'iub':
+                    schema.append((str(name),'q'))
+                elif dtype.kind == 'f':
+                    schema.append((str(name),'d'))
+                else:
+                    schema.append((str(name),'s'))
+            return schema
+        schema = []
+        for ind, value in enumerate(data[0]):
+            if isinstance(value,(bool,int)) or np is not None and isinstance(value,np.integer):
+                schema.append(("c{}".format(ind),'q'))
+            elif isinstance(value,float) or np is not None and isinstance(value,np.floating):
+                schema.append(("c{}".format(ind),'d'))
+            else:
+                schema.append(("c{}".format(ind),'s'))
+        return schema
+
+    def schema2Str(schema):
+        return [name + ':' + type_ for name, type_ in schema]
+
+    def str2Schema(strs):
+        schema = []
+        for s in strs:
+            name, type_ = s.rsplit(':',1)
+            assert type_ in TYPES
+            schema.append((name,type_))
+        return schema
+
+    def encodeBlock(data, schema):
+        # DataFrame or list of tuples --> bytes of one block
+        if pd is not None and isinstance(data,pd.DataFrame):
+            num_rows = len(data)
+            columns  = [data.iloc[:,ind] for ind in range(data.shape[1])]
+        else:
+            num_rows = len(data)
+            columns  = [list(col) for col in zip(*data)] if num_rows > 0 else [[] for _ in schema]
+        assert len(columns) == len(schema), "Data has {} columns, schema has {}".format(len(columns),len(schema))
+        parts = []
+        for col, (name, type_) in zip(columns, schema):
+            if type_ == 's':
+                encoded = [str(value).encode('utf-8') for value in col]
+                offsets = array('I',[0])
+                pos     = 0
+                for value in encoded:
+                    pos += len(value)
+                    offsets.append(pos)
+                payload = offsets.tobytes() + b''.join(encoded)
+            elif np is not None and not isinstance(col,list):
+                payload = col.to_numpy(dtype='<i8' if type_ == 'q' else '<f8').tobytes()
+            else:
+                payload = array(type_,col).tobytes()
+            parts.append(COLUMN_HEADER.pack(type_.encode(),len(payload)))
+            parts.append(payload)
+        body = b''.join(parts)
+        return HEADER.pack(MAGIC,HEADER.size + len(body),num_rows,len(schema)) + body
+
+    def blockLength(buffer, offset=0):
+        magic, length, num_rows, num_cols = HEADER.unpack_from(buffer,offset)
+        assert magic == MAGIC, "Not a columnar block at offset {}".format(offset)
+        return length
+
+    def decodeBlocks(buffer):
+        # bytes of whole blocks --> list of blocks, each a list of columns
+        # numeric columns are arrays viewing the buffer when numpy exists, strings are lists of str
+        buffer = memoryview(buffer)
+        blocks = []
+        offset = 0
+        while offset < len(buffer):
+            magic, length, num_rows, num_cols = HEADER.unpack_from(buffer,offset)
+            assert magic == MAGIC, "Not a columnar block at offset {}".format(offset)
+            pos     = offset + HEADER.size
+            columns = []
+            for _ in range(num_cols):
+                type_, payload_len = COLUMN_HEADER.unpack_from(buffer,pos)
+                type_   = type_.decode()
+                pos    += COLUMN_HEADER.size
+                payload = buffer[pos:(pos + payload_len)]
+                pos    += payload_len
+                if type_ == 's':
+                    offsets = array('I')
+                    offsets.frombytes(payload[:4*(num_rows+1)])
+                    strings = bytes(payload[4*(num_rows+1):])
+                    columns.append([strings[offsets[i]:offsets[i+1]].decode('utf-8') for i in range(num_rows)])
+                elif np is not None:
+                    columns.append(np.frombuffer(payload,dtype='<i8' if type_ == 'q' else '<f8'))
+                else:
+                    values = array(type_)
+                    values.frombytes(payload)
+                    columns.append(values)
+            blocks.append(columns)
+            offset += length
+        return blocks
+
+    def toTuples(buffer):
+        tuples = []
+        for columns in ColumnarFormat.decodeBlocks(buffer):
+            columns = [col.tolist() if hasattr(col,'tolist') else col for col in columns]
+            tuples.extend(zip(*columns))
+        return tuples
+
+    def toDataFrame(buffer, schema):
+        assert pd is not None, "pandas is required for reading a DataFrame"
+        names  = [name for name, _ in schema]
+        frames = [pd.DataFrame(dict(zip(names,columns))) for columns in ColumnarFormat.decodeBlocks(buffer)]
+        if len(frames) < 1:
+            return pd.DataFrame({name: [] for name in names})
+        return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
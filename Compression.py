@@ -0,0 +1,54 @@
+import zlib
+import lzma
+try:
+    import lz4.frame as lz4frame
+except ImportError:
+    lz4frame = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# codecs for compressing VirtualBigFile partitions one by one
+# "none", "zlib" and "lzma" are always available, "lz4" and "zstd" only when their packages are installed
+
+class Compression:
+    defaultLevels = {"zlib": 6, "lzma": 1, "lz4": 0, "zstd": 3}
+
+    def available():
+        codecs = ["none", "zlib", "lzma"]
+        if lz4frame is not None:
+            codecs.append("lz4")
+        if zstandard is not None:
+            codecs.append("zstd")
+        return codecs
+
+    def check(codec):
+        assert codec in Compression.available(), "Compression codec {} is not available".format(codec)
+
+    def compress(codec, data):
+        if codec == "none":
+            return data
+        level = Compression.defaultLevels[codec]
+        if codec == "zlib":
+            return zlib.compress(data, level)
+        if codec == "lzma":
+            return lzma.compress(data, preset=level)
+        if codec == "lz4":
+            return lz4frame.compress(data, compression_level=level)
+        if codec == "zstd":
+            return zstandard.ZstdCompressor(level=level).compress(data)
+        Compression.check(codec)
+
+    def decompress(codec, data):
+        if codec == "none":
+            return data
+        if codec == "zlib":
+            return zlib.decompress(data)
+        if codec == "lzma":
+            return lzma.decompress(data)
+        if codec == "lz4":
+            return lz4frame.decompress(data)
+        if codec == "zstd":
+            return zstandard.ZstdDecompressor().decompress(data)
+        Compression.check(codec)
@@ -0,0 +1,251 @@
+import argparse
+import logging
+import os
+import pickle
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import uuid
+from MockObjectStorage import MockObjectStorage
+
+# coordinator/worker execution of MapReduceEngine stages by processes on one or more hosts sharing a directory
+# the coordinator and all workers run in the shared directory, control objects of a job there:
+#   <job>.stage                 pickle of the current stage: id, number, name, task numbers and the pickled payload:
+#                               function, profile, max_retries, scratch namespace and the input objects of each task
+#                               the id is unique to the stage and the coordinator, so nothing of an earlier run of the job
+#                               (a crashed coordinator) is taken for the current stage
+#   <job>.claim.<stage>.<task>  lease of a task, created atomically by the worker running it
+#   <job>.done.<stage>.<task>   pickle of the task record, written after the outputs of the task are on disk
+#   <job>.failed.<stage>.<task> error of a task which failed after its retries
+#   <job>.worker.<worker>       heartbeat of a worker, rewritten every heartbeatSeconds
+#   <job>.end                   the job ended, its workers exit
+# a claim of a worker whose heartbeat did not change for heartbeatTimeout seconds of the coordinator's clock is deleted,
+# so another worker claims the task again. A stage whose waiting tasks no worker claimed for claimTimeout seconds fails
+# stage functions and input objects are pickled: functions must be importable by the workers (not defined in __main__)
+
+logger = logging.getLogger("MapReduceEngine")
+
+class DistributedEngine:
+    '''Coordinator of a distributed MapReduce job, the executor "distributed" of MapReduceEngine.execute
+    job: name of the job, prefix of its control objects
+    local_workers: worker processes started on this host by start(), others are started by
+                   python DistributedEngine.py worker <job> in the shared directory on any host
+    claim_timeout: seconds a stage waits for any worker to claim one of its tasks before it raises RuntimeError'''
+    pollSeconds      = 0.1
+    heartbeatSeconds = 1.0
+    heartbeatTimeout = 10.0
+    claimTimeout     = 60.0
+
+    def __init__(self, job=None, local_workers=0, heartbeat_timeout=0, claim_timeout=0):
+        self.job               = job if job is not None else "job-" + uuid.uuid4().hex[:12]
+        self.local_workers     = local_workers
+        self.heartbeat_timeout = heartbeat_timeout if heartbeat_timeout > 0 else DistributedEngine.heartbeatTimeout
+        self.claim_timeout     = claim_timeout if claim_timeout > 0 else DistributedEngine.claimTimeout
+        self.control           = DistributedEngine.controlStorage()
+        self.stage_number      = 0
+        self.stage_id          = None
+        self.tasks             = []
+        self.processes         = []
+        self.beats             = {} # worker --> [last heartbeat seen, time it was first seen]
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def controlStorage():
+        # control objects go straight to the shared directory, never through a cache
+        return MockObjectStorage(MaxCachedFiles=0, ReadThreads=0)
+
+    def objectName(job, kind, stage=None, task=None):
+        if stage is None:
+            return "{}.{}".format(job,kind)
+        return "{}.{}.{}.{}".format(job,kind,stage,task)
+
+    def start(self):
+        # starting the local workers, they import the stage functions by the module search path of this process
+        # control objects left by an earlier coordinator of the job which did not stop are deleted, not the heartbeats:
+        # stop waits for the workers behind them to exit
+        self.control.deleteObject([name for kind in ("stage", "claim", "done", "failed", "end")
+                                   for name in self.control.listObjects(DistributedEngine.objectName(self.job,kind))])
+        for _ in range(len(self.processes), self.local_workers):
+            self.processes.append(self.__startWorker__())
+
+    def __startWorker__(self):
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join([path if len(path) > 0 else os.getcwd() for path in sys.path])
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__), "worker", self.job], env=env)
+
+    def stop(self):
+        # telling the workers to exit and removing the control objects of the job
+        self.control.createObject(DistributedEngine.objectName(self.job,"end"), b'end')
+        for process in self.processes:
+            try:
+                process.wait(timeout=10*self.heartbeat_timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.processes = []
+        # the other workers delete their heartbeat when they exit, also those whose claims this coordinator never saw
+        heartbeats = self.control.listObjects(DistributedEngine.objectName(self.job,"worker") + ".")
+        deadline   = time.monotonic() + self.heartbeat_timeout
+        while time.monotonic() < deadline and any(self.control.readObject(name) is not None for name in heartbeats):
+            time.sleep(DistributedEngine.pollSeconds)
+        self.clearStage()
+        self.control.deleteObject([DistributedEngine.objectName(self.job,"stage"), DistributedEngine.objectName(self.job,"end")] +
+                                  heartbeats)
+        self.beats = {}
+
+    def clearStage(self):
+        # claims, done and failed objects of the current stage
+        self.control.deleteObject([DistributedEngine.objectName(self.job,kind,self.stage_id,task)
+                                   for kind in ("claim", "done", "failed") for task in self.tasks])
+        self.tasks = []
+
+    def runStage(self, name, process_function, tasks, profile=False, max_retries=0, on_done=None, context=None):
+        # tasks: {task number: input objects}, returns the task records
+        # on_done(task number, task record) is called by this thread when a task is done
+        # context: (storage, scratch namespace) of the job, workers use their own storage
+        # raises RuntimeError when a task failed after its retries, or when no worker claimed any of the waiting tasks
+        # for claim_timeout seconds (no worker runs the job)
+        self.clearStage()
+        self.stage_number += 1
+        self.stage_id      = "{}-{}".format(self.stage_number, uuid.uuid4().hex[:12])
+        self.tasks         = list(tasks)
+        # a worker which cannot unpickle the payload (function not importable there) still knows the tasks to fail
+        payload = pickle.dumps({"function": process_function, "profile": profile, "max_retries": max_retries,
+                                "namespace": context[1] if context is not None else "", "inputs": tasks},
+                               protocol=pickle.HIGHEST_PROTOCOL)
+        stage   = {"id": self.stage_id, "number": self.stage_number, "name": name, "tasks": list(tasks), "payload": payload}
+        self.control.createObject(DistributedEngine.objectName(self.job,"stage"), pickle.dumps(stage, protocol=pickle.HIGHEST_PROTOCOL))
+        pending      = set(tasks)
+        task_records = []
+        progress     = time.monotonic() # last time a task was done or held by a worker
+        while len(pending) > 0:
+            for task in sorted(pending):
+                done = self.control.readObject(DistributedEngine.objectName(self.job,"done",self.stage_id,task))
+                if done is not None and len(done) > 0:
+                    rec = pickle.loads(done)
+                    pending.discard(task)
+                    task_records.append(rec)
+                    if on_done is not None:
+                        on_done(task, rec)
+                    progress = time.monotonic()
+                    continue
+                failed = self.control.readObject(DistributedEngine.objectName(self.job,"failed",self.stage_id,task))
+                if failed is not None:
+                    raise RuntimeError("{} task {} failed on a worker:\n{}".format(name, task, failed.decode('utf-8','replace')))
+                if self.__checkClaim__(name, task):
+                    progress = time.monotonic()
+            if len(pending) > 0 and time.monotonic() - progress > self.claim_timeout:
+                raise RuntimeError("No worker claimed the {} tasks {} of job {} for {} seconds".format(
+                                   name, sorted(pending), self.job, self.claim_timeout))
+            if len(pending) > 0:
+                time.sleep(DistributedEngine.pollSeconds)
+            for ind, process in enumerate(self.processes):
+                if process.poll() is not None:
+                    logger.warning("Local worker {} of job {} exited with {}, starting another one".format(process.pid, self.job, process.returncode))
+                    self.processes[ind] = self.__startWorker__()
+        return task_records
+
+    def __checkClaim__(self, name, task):
+        # reassigning the task when the worker holding its claim stopped beating, returns whether a live worker holds it
+        claim_name = DistributedEngine.objectName(self.job,"claim",self.stage_id,task)
+        claim      = self.control.readObject(claim_name)
+        if claim is None or len(claim) < 1:
+            return False
+        worker = claim.decode('utf-8')
+        beat   = self.control.readObject(DistributedEngine.objectName(self.job,"worker") + "." + worker)
+        now    = time.monotonic()
+        seen   = self.beats.get(worker)
+        if seen is None or seen[0] != beat:
+            self.beats[worker] = [beat, now]
+        elif now - seen[1] > self.heartbeat_timeout:
+            logger.warning("Worker {} is not alive, {} task {} is reassigned".format(worker, name, task))
+            self.control.deleteObject(claim_name)
+            return False
+        return True
+
+    def runWorker(job, worker=None, exit_when_idle=0):
+        # claims and runs the tasks of the job until it ends
+        # exit_when_idle: seconds without a stage after which the worker exits, 0 waits for the end of the job
+        from MapReduceEngine import MapReduceEngine
+        from VirtualBigFile import getStorage
+        storage = getStorage()
+        worker  = worker if worker is not None else "{}-{}-{}".format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:6])
+        control = DistributedEngine.controlStorage()
+        beating = threading.Event()
+        def heartbeat():
+            beat = 0
+            while not beating.wait(DistributedEngine.heartbeatSeconds if beat > 0 else 0):
+                beat += 1
+                control.createObject(DistributedEngine.objectName(job,"worker") + "." + worker, "{} {}".format(beat,time.time()).encode())
+        thread = threading.Thread(target=heartbeat, name="Heartbeat", daemon=True)
+        thread.start()
+        logger.info("Worker {} of job {} is starting".format(worker,job))
+        idle_since = time.monotonic()
+        stage_id   = None # stage whose payload was unpickled
+        try:
+            while control.readObject(DistributedEngine.objectName(job,"end")) is None:
+                data  = control.readObject(DistributedEngine.objectName(job,"stage"))
+                stage = pickle.loads(data) if data is not None and len(data) > 0 else None
+                ran   = False
+                for task in (stage["tasks"] if stage is not None else []):
+                    if control.readObject(DistributedEngine.objectName(job,"done",stage["id"],task)) is not None:
+                        continue
+                    if not control.claimObject(DistributedEngine.objectName(job,"claim",stage["id"],task), worker.encode()):
+                        continue
+                    ran = True
+                    if stage_id != stage["id"]:
+                        try:
+                            payload  = pickle.loads(stage["payload"])
+                            stage_id = stage["id"]
+                        except Exception:
+                            control.createObject(DistributedEngine.objectName(job,"failed",stage["id"],task),
+                                                 traceback.format_exc().encode('utf-8'))
+                            continue
+                    input_objects = payload["inputs"][task]
+                    # other workers changed objects on disk behind the back of this worker's cache
+                    storage.clearCache()
+                    storage_start = storage.stats()
+                    try:
+                        rec = MapReduceEngine.run_thread(stage["name"], task, payload["function"], input_objects,
+                                                         payload["profile"], payload["max_retries"], (storage, payload["namespace"]))
+                    except Exception:
+                        control.createObject(DistributedEngine.objectName(job,"failed",stage_id,task),
+                                             traceback.format_exc().encode('utf-8'))
+                        continue
+                    storage.flush()
+                    storage_end    = storage.stats()
+                    rec["storage"] = {key: value - storage_start.get(key,0) for key, value in storage_end.items()}
+                    rec["worker"]  = worker
+                    control.createObject(DistributedEngine.objectName(job,"done",stage_id,task),
+                                         pickle.dumps(rec, protocol=pickle.HIGHEST_PROTOCOL))
+                if ran:
+                    idle_since = time.monotonic()
+                elif exit_when_idle > 0 and time.monotonic() - idle_since > exit_when_idle:
+                    break
+                else:
+                    time.sleep(DistributedEngine.pollSeconds)
+        finally:
+            beating.set()
+            thread.join()
+            control.deleteObject(DistributedEngine.objectName(job,"worker") + "." + worker)
+        logger.info("Worker {} of job {} exits".format(worker,job))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Worker of a distributed MapReduce job, run in the shared directory")
+    parser.add_argument("role", choices=["worker"])
+    parser.add_argument("job", help="name of the job given to DistributedEngine")
+    parser.add_argument("--name", help="name of this worker (default host-pid-random)")
+    parser.add_argument("--exit-when-idle", type=float, default=0, help="seconds without a stage after which the worker exits")
+    args = parser.parse_args(argv)
+    DistributedEngine.runWorker(args.job, args.name, args.exit_when_idle)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+from heapq import merge
+from operator import itemgetter
+import os
+import shutil
+import tempfile
+import pickle
+import zlib
+from VirtualBigFile import MB
+
+# rough python memory overhead of a new key (dict slot + list + str object) and of a new value (list slot + str object)
+KEY_OVERHEAD   = 120
+VALUE_OVERHEAD = 56
+
+class HashShuffle:
+    '''Hash partitioned shuffle of (key, value) pairs into R reduce partitions
+    Pairs are grouped in memory. When the memory budget is exceeded all partitions are spilled
+    to disk as sorted runs which are merged back in a streaming way when a partition is read.
+    Runs are written and read back in chunks of chunk_size groups, so reading a partition holds
+    only one chunk per run in memory.
+    An optional combiner(key, values) -> values shrinks the values of a key on each appended
+    map output and on each spilled run, it must give the same result when applied repeatedly.
+    A relative tempdir keeps the spill directory relative, so processes on other hosts find the runs
+    by the same path in their working directory of the shared directory.'''
+    defaultMemoryBudget = 64*MB
+    defaultChunkSize    = 4096
+
+    def __init__(self, num_partitions, memory_budget=0, tempdir=None, chunk_size=0, combiner=None):
+        assert num_partitions > 0
+        self.num_partitions = num_partitions
+        self.memory_budget  = memory_budget if memory_budget > 0 else HashShuffle.defaultMemoryBudget
+        self.chunk_size     = chunk_size if chunk_size > 0 else HashShuffle.defaultChunkSize
+        self.tempdir        = tempdir if tempdir is not None else os.getcwd()
+        self.combiner       = combiner
+        self.spilldir       = None
+        self.groups         = [{} for _ in range(num_partitions)]
+        self.runs           = [[] for _ in range(num_partitions)] # file names of the runs in spilldir
+        self.memory_used    = 0
+        self.spilled_bytes  = 0
+        self.num_pairs      = 0
+        self.num_runs       = 0
+        self.keep_on_failure = False # a shuffle of a restartable job outlives a failed job, which is resumed from it
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None or not self.keep_on_failure:
+            self.delete()
+
+    def __getstate__(self):
+        # readers of the partitions in other processes do not need the combiner, which may be a lambda
+        state = dict(self.__dict__)
+        state["combiner"] = None
+        return state
+
+    def partitionOf(self, key):
+        # stable across processes, unlike the built-in hash() of strings
+        return zlib.crc32(key.encode()) % self.num_partitions
+
+    def iterPairs(pairs):
+        if hasattr(pairs,'itertuples'):
+            # pandas DataFrame with key,value columns
+            pairs = pairs.itertuples(index=False, name=None)
+        for key, value in pairs:
+            yield str(key), str(value)
+
+    def combine(pairs, combiner):
+        # grouping pairs locally and replacing the values of each key by combiner(key, values)
+        groups = {}
+        for key, value in HashShuffle.iterPairs(pairs):
+            values = groups.get(key)
+            if values is None:
+                groups[key] = [value]
+            else:
+                values.append(value)
+        return [(key, value) for key, values in groups.items() for value in combiner(key, values)]
+
+    def append(self, pairs):
+        if self.combiner is not None:
+            pairs = HashShuffle.combine(pairs, self.combiner)
+        for key, value in HashShuffle.iterPairs(pairs):
+            self.num_pairs += 1
+            group = self.groups[self.partitionOf(key)]
+            values = group.get(key)
+            if values is None:
+                group[key] = [value]
+                self.memory_used += len(key) + len(value) + KEY_OVERHEAD
+            else:
+                values.append(value)
+                self.memory_used += len(value) + VALUE_OVERHEAD
+            if self.memory_used > self.memory_budget:
+                self.spill()
+
+    def spill(self):
+        if self.spilldir is None:
+            # mkdtemp returns an absolute path (python 3.12), which is not the path of the directory on other hosts
+            self.spilldir = os.path.join(self.tempdir, os.path.basename(tempfile.mkdtemp(prefix="shuffle-", dir=self.tempdir)))
+        for indPartition, group in enumerate(self.groups):
+            if len(group) < 1:
+                continue
+            runs     = self.runs[indPartition]
+            run_name = "run-{:05d}-{:05d}.pkl".format(indPartition,len(runs))
+            filename = os.path.join(self.spilldir, run_name)
+            if self.combiner is not None:
+                items = sorted((key, list(self.combiner(key, values))) for key, values in group.items())
+            else:
+                items = sorted(group.items())
+            with open(filename,"wb") as f:
+                for indStart in range(0,len(items),self.chunk_size):
+                    pickle.dump(items[indStart:(indStart + self.chunk_size)], f, protocol=pickle.HIGHEST_PROTOCOL)
+            self.spilled_bytes += os.path.getsize(filename)
+            runs.append(run_name)
+            self.num_runs += 1
+            self.groups[indPartition] = {}
+        self.memory_used = 0
+
+    def seal(self):
+        # no more appends: once anything was spilled the rest is spilled too,
+        # so the reducers stream everything from disk and the in-memory groups are released
+        if self.spilldir is not None and self.memory_used > 0:
+            self.spill()
+
+    def persist(self):
+        # spilling everything to disk, returns the state for reopening the shuffle by HashShuffle.load
+        # in another process or after this one ended. No more appends
+        # the spill directory is kept relative to the working directory when it is inside it
+        if self.spilldir is None or self.memory_used > 0:
+            self.spill()
+        spilldir = os.path.relpath(self.spilldir)
+        spilldir = spilldir if not spilldir.startswith(os.pardir) else os.path.abspath(self.spilldir)
+        return {"num_partitions": self.num_partitions, "spilldir": spilldir, "runs": self.runs,
+                "spilled_bytes": self.spilled_bytes, "num_pairs": self.num_pairs, "num_runs": self.num_runs}
+
+    def load(state, combiner=None):
+        # a persisted shuffle from the state returned by persist, None when its runs are gone
+        # a relative spill directory is found in the working directory of this process
+        runs = state["runs"]
+        if any(not os.path.isfile(os.path.join(state["spilldir"], run_name)) for partition_runs in runs for run_name in partition_runs):
+            return None
+        shuffle = HashShuffle(state["num_partitions"], tempdir=os.path.dirname(state["spilldir"]) or os.curdir, combiner=combiner)
+        shuffle.spilldir      = state["spilldir"]
+        shuffle.runs          = [list(partition_runs) for partition_runs in runs]
+        shuffle.spilled_bytes = state["spilled_bytes"]
+        shuffle.num_pairs     = state["num_pairs"]
+        shuffle.num_runs      = state["num_runs"]
+        shuffle.keep_on_failure = True
+        return shuffle
+
+    def readRun(filename):
+        with open(filename,"rb") as f:
+            while True:
+                try:
+                    chunk = pickle.load(f)
+                except EOFError:
+                    return
+                yield from chunk
+
+    def readPartition(self, indPartition):
+        # lazily yields (key, comma separated values) sorted by key, merging the spilled runs with the in-memory groups
+        sources = [HashShuffle.readRun(os.path.join(self.spilldir, run_name)) for run_name in self.runs[indPartition]]
+        if len(self.groups[indPartition]) > 0:
+            sources.append(sorted(self.groups[indPartition].items()))
+        last_key, last_values = None, None
+        for key, values in merge(*sources, key=itemgetter(0)):
+            if key == last_key:
+                last_values.extend(values)
+                continue
+            if last_values is not None:
+                yield last_key, ','.join(last_values)
+            last_key, last_values = key, list(values)
+        if last_values is not None:
+            yield last_key, ','.join(last_values)
+
+    def partitions(self):
+        return [ShufflePartition(self, ind) for ind in range(self.num_partitions)]
+
+    def delete(self):
+        self.groups      = [{} for _ in range(self.num_partitions)]
+        self.runs        = [[] for _ in range(self.num_partitions)]
+        self.memory_used = 0
+        if self.spilldir is not None:
+            shutil.rmtree(self.spilldir, ignore_errors=True)
+            self.spilldir = None
+
+class ShufflePartition:
+    '''Input of one reduce thread: iterating it lazily yields the rows of a single shuffle partition
+    The merge of the partition's runs happens while the reducer consumes the rows, rows_read counts them'''
+    def __init__(self, shuffle, indPartition):
+        self.shuffle      = shuffle
+        self.indPartition = indPartition
+        self.rows_read    = 0
+
+    def __iter__(self):
+        for row in self.shuffle.readPartition(self.indPartition):
+            self.rows_read += 1
+            yield row
@@ -0,0 +1,92 @@
+import hashlib
+import json
+
+# commit log of a restartable MapReduce job, one append only object <job name>.commits of the object storage
+# each line is the json commit marker of a task: {"stage": name, "task": number, "split": its input objects, "job": fingerprint}
+# appended only after the outputs of the task are on disk
+#   "job": fingerprint of the job's input list and number of reducers, markers of other inputs are ignored
+#   "inputs": fingerprint of the input objects of the task's split, when they are known
+#   "split": null cancels the commit, for example when the shuffle consumed the map output of the task
+#   "state": state of a finished step which is not a task, like the persisted shuffle
+# the last marker of a (stage, task) wins, a torn last line of a crashed job is ignored
+
+class JobCheckpoint:
+    '''Task level checkpoints of a MapReduce job
+    resume: keeps the commits of an earlier run of the job, otherwise they are dropped
+    job: what the commits depend on, like the input list and the number of reducers, commits of a run with
+         another job are ignored'''
+    def __init__(self, objectStorage, job_name, resume=False, job=None):
+        self.objectStorage = objectStorage
+        self.job_name      = job_name
+        self.name          = job_name + ".commits"
+        self.job           = JobCheckpoint.fingerprint(job)
+        self.markers       = {} # (stage, task) --> last marker
+        self.ignored       = 0  # markers of an earlier run with another job
+        self.torn          = False # the log ends with a torn line
+        if resume:
+            self.load()
+        else:
+            self.clear()
+
+    def load(self):
+        view = self.objectStorage.mapObject(self.name)
+        if view is None:
+            return
+        self.torn = len(view) > 0 and view[-1] != ord('\n')
+        for line in bytes(view).split(b'\n'):
+            try:
+                marker = json.loads(line)
+            except ValueError:
+                continue
+            if marker.get("job") != self.job:
+                self.ignored += 1
+                continue
+            self.markers[(marker["stage"],marker["task"])] = marker
+
+    def fingerprint(objects):
+        # digest of a list of input objects by their names (repr of other objects)
+        return hashlib.sha1(repr(objects).encode('utf-8')).hexdigest()
+
+    def jsonSplit(split):
+        # the split as it is read back from the log: tuples become lists
+        return json.loads(json.dumps(split))
+
+    def committed(self, stage, task, split, inputs=None):
+        # True when the task was committed with the same split and input objects
+        marker = self.markers.get((stage,task))
+        if marker is None or marker.get("split") is None or marker["split"] != JobCheckpoint.jsonSplit(split):
+            return False
+        return inputs is None or marker.get("inputs") == JobCheckpoint.fingerprint(inputs)
+
+    def commit(self, stage, task, split, state=None, inputs=None):
+        # the outputs of the task are written before its marker
+        # inputs: input objects of the split, a later run skips the task only with the same ones
+        self.objectStorage.flush()
+        marker = {"stage": stage, "task": task, "split": JobCheckpoint.jsonSplit(split), "job": self.job}
+        if inputs is not None:
+            marker["inputs"] = JobCheckpoint.fingerprint(inputs)
+        if state is not None:
+            marker["state"] = state
+        self.__append__(marker)
+
+    def cancel(self, stage, task):
+        if (stage,task) in self.markers:
+            self.__append__({"stage": stage, "task": task, "split": None, "job": self.job})
+
+    def state(self, stage):
+        # state committed for a stage, None when there is none
+        marker = self.markers.get((stage,0))
+        return marker.get("state") if marker is not None and marker.get("split") is not None else None
+
+    def clear(self):
+        self.objectStorage.deleteObject(self.name)
+        self.markers = {}
+        self.torn    = False
+
+    def __append__(self, marker):
+        line = json.dumps(marker).encode('utf-8') + b'\n'
+        if self.torn:
+            line      = b'\n' + line
+            self.torn = False
+        self.objectStorage.appendObject(self.name, line)
+        self.markers[(marker["stage"],marker["task"])] = marker
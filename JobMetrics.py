@@ -0,0 +1,188 @@
+import json
+import os
+import time
+import threading
+import cProfile
+import pstats
+
+# metrics of one MapReduceEngine.execute run
+# counters: name --> number, for example the bytes spilled by the shuffle
+# stages:   one record per stage: duration, tasks, workers, object storage counters, cache hit rate, straggler skew
+# tasks:    one record per task: stage, task number, start and end time, process and thread, input objects,
+#           records_in: shuffle groups read by a reduce task, records_out: pairs a map task gave to the shuffle
+# times are seconds since the epoch, the exports give them relative to the start of the job
+
+# object storage counters which are current values and not totals, a stage reports them at its end
+GAUGES = ("cached_objects", "cached_bytes")
+
+class ProfileStats:
+    '''Raw stats of a cProfile run as a pstats source, they can be pickled back from a worker process'''
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+class JobMetrics:
+    '''Counters, stage and task timings of one MapReduce job
+    profile: every task runs under cProfile and its stats are summed per stage (see profileStats)'''
+    def __init__(self, profile=False):
+        self.profile    = profile
+        self.start_time = time.time()
+        self.end_time   = None
+        self.pid        = os.getpid()
+        self.counters   = {}
+        self.stages     = []
+        self.tasks      = []
+        self.profiles   = {} # stage name --> pstats.Stats
+        self.lock       = threading.Lock()
+
+    def add(self, name, value=1):
+        self.lock.acquire()
+        self.counters[name] = self.counters.get(name,0) + value
+        self.lock.release()
+
+    def addStage(self, name, executor, start_time, end_time, input_objects, tasks, workers, storage_start, storage_end,
+                 task_records):
+        # task_records: records of the tasks of this stage, a record of a worker process may carry the storage
+        # counters and the profile of its task
+        storage = {}
+        for key, value in storage_end.items():
+            storage[key] = value if key in GAUGES else value - storage_start.get(key,0)
+        for rec in task_records:
+            for key, value in rec.pop("storage",{}).items():
+                if key not in GAUGES:
+                    storage[key] = storage.get(key,0) + value
+            profile = rec.pop("profile",None)
+            if profile is not None:
+                self.addProfile(name, profile)
+        lookups   = storage.get("hits",0) + storage.get("misses",0)
+        records   = [rec["records_in"] for rec in task_records if rec.get("records_in") is not None]
+        durations = sorted(rec["end"] - rec["start"] for rec in task_records)
+        stage = {"name": name, "executor": executor, "start": start_time, "end": end_time,
+                 "seconds": end_time - start_time, "input_objects": input_objects, "tasks": tasks, "workers": workers,
+                 "storage": storage, "cache_hit_rate": storage.get("hits",0) / lookups if lookups > 0 else None,
+                 "records_in": sum(records) if len(records) > 0 else None, "records_out": None}
+        if len(durations) > 0:
+            median = durations[len(durations)//2]
+            stage["task_seconds"] = {"min": durations[0], "median": median, "max": durations[-1]}
+            # straggler skew: slowest task relative to the typical one
+            stage["skew"] = durations[-1] / median if median > 0 else None
+        self.lock.acquire()
+        self.stages.append(stage)
+        self.tasks.extend(task_records)
+        self.lock.release()
+        return stage
+
+    def addRecordsOut(self, stage, task, records):
+        # records a task gave to the next stage, known only after the stage ended (map output read by the shuffle)
+        self.lock.acquire()
+        for rec in self.tasks:
+            if rec["stage"] == stage and rec["task"] == task:
+                rec["records_out"] = records
+        for rec in self.stages:
+            if rec["name"] == stage:
+                rec["records_out"] = (rec["records_out"] or 0) + records
+        self.lock.release()
+
+    def addProfile(self, stage, stats):
+        source = ProfileStats(stats)
+        self.lock.acquire()
+        if stage in self.profiles:
+            self.profiles[stage].add(source)
+        else:
+            self.profiles[stage] = pstats.Stats(source)
+        self.lock.release()
+
+    def profileStats(self, stage):
+        # pstats.Stats summed over all tasks of the stage, None when it was not profiled
+        return self.profiles.get(stage)
+
+    def dumpProfiles(self, prefix):
+        # one pstats file per profiled stage: <prefix>.<stage>.prof, readable by pstats and snakeviz
+        filenames = []
+        for stage, stats in self.profiles.items():
+            filename = "{}.{}.prof".format(prefix,stage)
+            stats.dump_stats(filename)
+            filenames.append(filename)
+        return filenames
+
+    def finish(self):
+        self.end_time = time.time()
+
+    def seconds(self):
+        end_time = self.end_time if self.end_time is not None else time.time()
+        return end_time - self.start_time
+
+    def toDict(self):
+        start = self.start_time
+        stages = []
+        for stage in self.stages:
+            stage = dict(stage)
+            stage["start"] -= start
+            stage["end"]   -= start
+            stages.append(stage)
+        tasks = []
+        for task in self.tasks:
+            task = dict(task)
+            task["start"] -= start
+            task["end"]   -= start
+            tasks.append(task)
+        return {"start_time": start, "seconds": self.seconds(), "counters": dict(self.counters),
+                "stages": stages, "tasks": tasks}
+
+    def toJSON(self, filename=None):
+        text = json.dumps(self.toDict(), indent=1)
+        if filename is not None:
+            with open(filename,"w") as f:
+                f.write(text)
+        return text
+
+    def toChromeTrace(self, filename=None):
+        # trace event format of chrome://tracing and Perfetto: complete events with times in microseconds
+        # stages on the thread 0 of the job's process, tasks on the process and thread that ran them
+        def micros(t):
+            return int(round((t - self.start_time) * 1e6))
+        events = [{"name": "process_name", "ph": "M", "pid": self.pid, "tid": 0, "args": {"name": "MapReduce job"}}]
+        for stage in self.stages:
+            args = {key: stage[key] for key in ("executor", "input_objects", "tasks", "workers", "storage", "skew", "records_in",
+                                                "records_out") if stage.get(key) is not None}
+            events.append({"name": stage["name"], "cat": "stage", "ph": "X", "ts": micros(stage["start"]),
+                           "dur": micros(stage["end"]) - micros(stage["start"]), "pid": self.pid, "tid": 0, "args": args})
+        for task in self.tasks:
+            events.append({"name": "{} {}".format(task["stage"],task["task"]), "cat": task["stage"], "ph": "X",
+                           "ts": micros(task["start"]), "dur": micros(task["end"]) - micros(task["start"]),
+                           "pid": task["pid"], "tid": task["tid"],
+                           "args": {key: task[key] for key in ("input_objects", "records_in", "records_out") if task.get(key) is not None}})
+        end_time = self.end_time if self.end_time is not None else time.time()
+        for name, value in self.counters.items():
+            events.append({"name": name, "ph": "C", "ts": micros(end_time), "pid": self.pid, "args": {name: value}})
+        text = json.dumps({"traceEvents": events, "displayTimeUnit": "ms"})
+        if filename is not None:
+            with open(filename,"w") as f:
+                f.write(text)
+        return text
+
+    def __repr__(self):
+        stages = ", ".join("{} {:.3f}s".format(stage["name"],stage["seconds"]) for stage in self.stages)
+        return "JobMetrics({:.3f}s: {})".format(self.seconds(),stages)
+
+    def taskRecord(stage, threadID, input_objects, start_time, end_time):
+        # input objects counting the rows they gave, like ShufflePartition, give records_in
+        return {"stage": stage, "task": threadID, "start": start_time, "end": end_time, "pid": os.getpid(),
+                "tid": threading.get_ident(), "input_objects": len(input_objects) if hasattr(input_objects,'__len__') else None,
+                "records_in": getattr(input_objects,"rows_read",None), "records_out": None}
+
+    def runProfiled(process_function, threadID, input_objects):
+        # (result, raw cProfile stats), stats are None when another profiler is active in this thread
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            return process_function(threadID, input_objects), None
+        try:
+            res = process_function(threadID, input_objects)
+        finally:
+            profiler.disable()
+        profiler.create_stats()
+        return res, profiler.stats
@@ -1,75 +1,453 @@
-import sqlite3
-import threading
-import pandas as pd
+import multiprocessing
+import concurrent.futures
+import logging
 import os
+import sys
+import threading
 import time
+import uuid
+from VirtualBigFile import VirtualBigFile, getStorage, setStorage
+from MockObjectStorage import MockObjectStorage
+from HashShuffle import HashShuffle
+from JobMetrics import JobMetrics
+from JobCheckpoint import JobCheckpoint
+from DistributedEngine import DistributedEngine
+
+# progress messages of the engine, printed to stdout unless the application configured this logger
+logger = logging.getLogger("MapReduceEngine")
+if not logger.handlers:
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# function, input objects and storage of the running process stages, by stage key (concurrent jobs run stages together)
+# forked workers inherit them from the parent instead of receiving a pickled copy
+_process_stage_payloads = {}
+
+# scratch namespace of the job run by a thread, see MapReduceEngine.scratch_name
+_job_context = threading.local()
 
 class MapReduceEngine():
     '''Class for implementing MapReduce'''
 
-    @staticmethod    
-    def execute(input_data, map_process_creator, shuffle_read_temp_from_input, reduce_process_creator, max_threads=8):
-        '''Function to execute the logic of MapReduce'''
-        #run mapping
+    executors      = ("threads", "processes", "serial", "distributed")
+    schedulers     = ("static", "dynamic")
+    tasksPerWorker = 4
+
+    @staticmethod
+    def execute(input_data, map_process_creator, shuffle_read_temp_from_input, reduce_process_creator, max_threads=8, executor="threads",
+                num_reducers=0, shuffle_memory=0, combiner_creator=None, scheduler="static", task_bytes=0, input_size=None,
+                metrics=None, profile=False, max_retries=2, job_name=None, resume=False, cluster=None, storage=None, namespace=None):
+        '''Function to execute the logic of MapReduce
+        executor: "threads"   - one thread per split (default)
+                  "processes" - one worker process per split, bypassing the GIL for CPU bound map/reduce functions
+                  "serial"    - all splits one after another in the calling thread
+                  "distributed" - tasks are claimed by worker processes on any host sharing the working directory,
+                                  see DistributedEngine. Map and reduce functions must be importable by the workers
+        scheduler: "static"   - map input is split to max_threads splits of equal count (default)
+                   "dynamic"  - map input is split to tasks of about task_bytes (default total/(4*max_threads))
+                                which max_threads workers pull largest first. threadID is then the task number
+        input_size(input_object) -> bytes: size of a map input for the dynamic scheduler (default MapReduceEngine.input_size)
+        num_reducers:   number of shuffle partitions, each reduce thread gets exactly one (default max_threads)
+        shuffle_memory: bytes of grouped map output kept in memory before spilling sorted runs to disk
+        combiner_creator(key, values) -> values: optional combiner applied on each map thread's output as it enters
+                        the shuffle and on each spilled run, for example lambda key, values: set(values).
+                        Map functions shrink their own output before writing it by MapReduceEngine.combine(pairs, combiner)
+        metrics: JobMetrics collecting the counters, stage and task timings of this run (default a new one)
+        profile: runs every task under cProfile, see JobMetrics.profileStats
+        max_retries: times a failing task is run again before its exception is raised by execute
+        job_name: makes the job restartable: every finished task is committed into the object <job_name>.commits
+                  and the shuffle is kept on disk until the job completes
+        resume: skips the tasks of job_name committed by an earlier run with the same input list, num_reducers and splits,
+                and the map stage and shuffle when the shuffle was committed. Commits of other inputs are ignored
+        cluster: DistributedEngine coordinating the workers of the distributed executor
+                 (default one named job_name with max_threads local workers, stopped at the end of the job)
+        storage: MockObjectStorage of the job, used by the VirtualBigFile and SmallFilesContainer objects its tasks open
+                 without one (default the storage of the calling thread, see VirtualBigFile.getStorage).
+                 A dict of MockObjectStorage options creates a storage with its own cache which is closed at the end of the job.
+                 Worker processes which are not forked and distributed workers use their own default storage
+        namespace: prefix of the job's scratch objects, map and reduce functions name them by MapReduceEngine.scratch_name
+                   (default "<job_name>.scratch." or a unique one). It may contain a directory, which is created.
+                   The scratch objects are deleted at the end of the job, unless it failed and job_name keeps it restartable
+        returns the JobMetrics of the run, exportable by toJSON and toChromeTrace
+        '''
+        assert executor in MapReduceEngine.executors, "Unknown executor: {}".format(executor)
+        assert scheduler in MapReduceEngine.schedulers, "Unknown scheduler: {}".format(scheduler)
+        metrics = metrics if metrics is not None else JobMetrics(profile)
+        profile = profile or metrics.profile
+        own_storage = isinstance(storage,dict)
+        if own_storage:
+            storage = MockObjectStorage(**storage)
+        storage = storage if storage is not None else getStorage()
+        if namespace is None:
+            namespace = "{}.scratch.".format(job_name if job_name is not None else "job-" + uuid.uuid4().hex[:12])
+        directory = os.path.dirname(namespace)
+        new_directory = len(directory) > 0 and not os.path.isdir(directory)
+        if new_directory:
+            os.makedirs(directory)
+        checkpoint = None
+        if job_name is not None:
+            # commits of a run with other inputs or another number of reducers are not resumed
+            job = [list(input_data), num_reducers if num_reducers > 0 else max_threads]
+            checkpoint = JobCheckpoint(storage, job_name, resume, job)
+            if checkpoint.ignored > 0:
+                logger.warning("Job {} ignores {} commits of an earlier run with other inputs".format(job_name, checkpoint.ignored))
+        own_cluster = executor == "distributed" and cluster is None
+        if own_cluster:
+            cluster = DistributedEngine(job_name, local_workers=max_threads)
+        if executor == "distributed":
+            cluster.start()
+        # the thread running the job opens its files in the job's storage and namespace, like the tasks
+        previous  = MapReduceEngine.set_context((storage, namespace))
+        completed = False
+        try:
+            metrics = MapReduceEngine.execute_stages(input_data, map_process_creator, shuffle_read_temp_from_input, reduce_process_creator,
+                                                     max_threads, executor, num_reducers, shuffle_memory, combiner_creator, scheduler,
+                                                     task_bytes, input_size, metrics, profile, max_retries, checkpoint, cluster,
+                                                     (storage, namespace))
+            completed = True
+        finally:
+            MapReduceEngine.set_context(previous)
+            if own_cluster:
+                cluster.stop()
+            if len(namespace) > 0 and (completed or checkpoint is None):
+                MapReduceEngine.delete_scratch(storage, namespace, new_directory)
+            if own_storage:
+                storage.close()
+        return metrics
+
+    def scratch_name(name):
+        '''Name of a scratch object of the job run by this thread, for example the output of a map task
+        Concurrent jobs get different names for the same name, outside a job it is name itself'''
+        return getattr(_job_context,"namespace","") + name
+
+    def set_context(context):
+        # (storage, namespace) of the job run by this thread, returns the previous one
+        previous = (getStorage(), getattr(_job_context,"namespace",""))
+        setStorage(context[0])
+        _job_context.namespace = context[1]
+        return previous
+
+    def delete_scratch(storage, namespace, delete_directory=False):
+        # objects left in the namespace, for example map outputs which were not consumed
+        storage.deleteObject(storage.listObjects(namespace))
+        if delete_directory:
+            try:
+                os.rmdir(os.path.dirname(namespace))
+            except OSError:
+                pass
+
+    def execute_stages(input_data, map_process_creator, shuffle_read_temp_from_input, reduce_process_creator, max_threads, executor,
+                       num_reducers, shuffle_memory, combiner_creator, scheduler, task_bytes, input_size, metrics, profile, max_retries,
+                       checkpoint, cluster, context):
+        options    = {"metrics": metrics, "profile": profile, "max_retries": max_retries, "checkpoint": checkpoint, "cluster": cluster,
+                      "context": context}
         start_time = time.time()
-        num_threads = MapReduceEngine.run_threads("Map", input_data, map_process_creator, max_threads)
-        conn   = sqlite3.connect('temp.db')
-        cursor = conn.cursor()
-        cursor.execute('''CREATE TABLE IF NOT EXISTS temp_results
-                      (key TEXT, value TEXT)''')
-        conn.commit()
-        for i in range(num_threads):
-            data = shuffle_read_temp_from_input(i)
-            #use SQL to save results of mapping to database
-            data.to_sql('temp_results', conn, if_exists='append',index=False)
-        cursor = conn.cursor()
-        #get results of mapping in list
-        cursor.execute('SELECT key, GROUP_CONCAT(value) FROM temp_results GROUP BY key ORDER BY key ASC')
-        rows = cursor.fetchall()
-        conn.close()
-        os.remove('temp.db')
-        #run reduce logic
-        MapReduceEngine.run_threads("Reduce", rows, reduce_process_creator, max_threads)
+        num_reducers = num_reducers if num_reducers > 0 else max_threads
+        shuffle_state = checkpoint.state("Shuffle") if checkpoint is not None else None
+        shuffle = HashShuffle.load(shuffle_state, combiner_creator) if shuffle_state is not None else None
+        if shuffle is not None:
+            logger.info("Resuming job {} after its shuffle".format(checkpoint.job_name))
+        else:
+            #run mapping
+            if scheduler == "dynamic":
+                input_size  = input_size if input_size is not None else MapReduceEngine.input_size
+                input_sizes = [input_size(obj) for obj in input_data]
+            else:
+                input_sizes = None
+            num_threads = MapReduceEngine.run_threads("Map", input_data, map_process_creator, max_threads, executor,
+                                                      input_sizes=input_sizes, task_bytes=task_bytes, **options)
+            map_end_time = time.time()
+            #hash partition results of mapping into one partition per reducer
+            # workers on other hosts read the shuffle runs by their path relative to the shared directory
+            tempdir = os.curdir if executor == "distributed" else None
+            shuffle = HashShuffle(num_reducers, memory_budget=shuffle_memory, tempdir=tempdir, combiner=combiner_creator)
+            try:
+                for i in range(num_threads):
+                    num_pairs = shuffle.num_pairs
+                    shuffle.append(shuffle_read_temp_from_input(i))
+                    metrics.addRecordsOut("Map", i, shuffle.num_pairs - num_pairs)
+                    if checkpoint is not None:
+                        # the output may be gone once read --> the task runs again unless the shuffle is committed
+                        checkpoint.cancel("Map", i)
+                shuffle.seal()
+                if checkpoint is not None:
+                    shuffle.keep_on_failure = True
+                    checkpoint.commit("Shuffle", 0, num_threads, shuffle.persist())
+                elif executor == "distributed":
+                    shuffle.persist()
+            except BaseException:
+                shuffle.delete()
+                raise
+            metrics.add("shuffle_seconds", time.time() - map_end_time)
+        with shuffle:
+            metrics.add("shuffle_pairs", shuffle.num_pairs)
+            metrics.add("shuffle_spilled_bytes", shuffle.spilled_bytes)
+            metrics.add("shuffle_runs", shuffle.num_runs)
+            if shuffle.spilled_bytes > 0:
+                logger.info("Shuffle spilled {} bytes to disk".format(shuffle.spilled_bytes))
+            #run reduce logic, each reducer streams its own partition
+            MapReduceEngine.run_threads("Reduce", shuffle.partitions(), reduce_process_creator, max_threads, executor, partitioned=True,
+                                        **options)
+        if checkpoint is not None:
+            checkpoint.clear()
         end_time = time.time()
-        print("MapReduce Completed in {} seconds.".format(end_time - start_time))
-        return
-    
-    def run_threads(name, input_objects, process_function, max_threads):
+        metrics.finish()
+        logger.info("MapReduce Completed in {} seconds.".format(end_time - start_time))
+        return metrics
+
+    def combine(pairs, combiner):
+        '''Map side combining of (key, value) pairs for map functions before they write their output'''
+        return HashShuffle.combine(pairs, combiner)
+
+    def input_size(input_object):
+        # size in bytes of a file on disk or of a VirtualBigFile, other inputs count as one byte
+        if isinstance(input_object,str):
+            if os.path.isfile(input_object):
+                return os.path.getsize(input_object)
+            return max(VirtualBigFile.fileSize(input_object),1)
+        return 1
+
+    def split_input(input_len, num_threads):
+        # contiguous splits of equal count, first splits get the residue
+        split_size    = input_len // num_threads
+        split_residue = input_len % num_threads
+        splits        = []
+        for ind in range(num_threads):
+            if ind < split_residue:
+                start = ind*(split_size+1)
+                end   = (ind+1)*(split_size+1)
+            else:
+                start = split_residue*(split_size+1) + (ind-split_residue)*split_size
+                end   = start+split_size
+            splits.append((start,end))
+        return splits
+
+    def split_by_size(input_sizes, task_bytes):
+        # contiguous splits of about task_bytes each
+        splits = []
+        start  = 0
+        size   = 0
+        for ind, input_size in enumerate(input_sizes):
+            size += input_size
+            if size >= task_bytes:
+                splits.append((start,ind+1))
+                start = ind+1
+                size  = 0
+        if start < len(input_sizes):
+            splits.append((start,len(input_sizes)))
+        return splits
+
+    def run_threads(name, input_objects, process_function, max_threads, executor="threads", partitioned=False,
+                    input_sizes=None, task_bytes=0, metrics=None, profile=False, max_retries=0, checkpoint=None, cluster=None,
+                    context=None):
+        # partitioned: input_objects are already split, thread ind gets input_objects[ind]
+        # input_sizes: bytes of each input object, input is split to tasks by size instead of count
+        # metrics: JobMetrics getting the record of this stage and of its tasks
+        # checkpoint: JobCheckpoint, committed tasks are skipped and finished ones are committed
+        # context: (storage, scratch namespace) of the job, set for every task
         start_time    = time.time()
+        storage       = context[0] if context is not None else getStorage()
+        storage_start = storage.stats()
         input_len     = len(input_objects)
-        num_threads   = min(input_len,max_threads)
-
-        print("Starting {} stage with {} input objects splitted to {} threads...".format(name,input_len,num_threads))
-        
-        if num_threads > 1:
-            # create threads
-            split_size    = input_len // num_threads
-            split_residue = input_len % num_threads
-            threads_vec   = []
-            for ind in range(num_threads):
-                if ind < split_residue:
-                    start = ind*(split_size+1)
-                    end   = (ind+1)*(split_size+1)
-                else:
-                    start = split_residue*(split_size+1) + (ind-split_residue)*split_size
-                    end   = start+split_size
-
-                args = (name, ind, process_function, input_objects[start:end])
-                threads_vec.append(threading.Thread(target=MapReduceEngine.run_thread, args=args))
-            for t in threads_vec:
-                t.start()
-            #wait for threads to finish
-            for t in threads_vec:
-                t.join()
+        order         = None
+        if partitioned:
+            splits    = list(range(input_len))
+        elif input_sizes is not None and input_len > 0:
+            total_bytes = sum(input_sizes)
+            if task_bytes < 1:
+                task_bytes = max(total_bytes // (max_threads*MapReduceEngine.tasksPerWorker),1)
+            splits    = MapReduceEngine.split_by_size(input_sizes, task_bytes)
+            # largest tasks first, so the smallest ones fill the gaps at the end of the stage
+            split_sizes = [sum(input_sizes[start:end]) for start,end in splits]
+            order     = sorted(range(len(splits)), key=lambda ind: -split_sizes[ind])
         else:
-            MapReduceEngine.run_thread(name, 0, process_function, input_objects)
+            splits    = MapReduceEngine.split_input(input_len, min(input_len,max_threads)) if input_len > 1 else []
+        num_threads   = len(splits)
+        num_workers   = min(num_threads,max_threads)
+
+        logger.info("Starting {} stage with {} input objects splitted to {} tasks on {} {}...".format(name,input_len,num_threads,num_workers,executor))
+
+        task_options = {"profile": profile, "max_retries": max_retries, "context": context}
+        if num_threads > 1 or partitioned:
+            order = list(order if order is not None else range(num_threads))
+            if checkpoint is not None:
+                committed = set(ind for ind in order if checkpoint.committed(name, ind, splits[ind],
+                                                                             MapReduceEngine.split_inputs(input_objects, splits[ind])))
+                if len(committed) > 0:
+                    logger.info("{} stage skips {} tasks committed by an earlier run".format(name,len(committed)))
+                    order = [ind for ind in order if ind not in committed]
+            task_records = MapReduceEngine.run_splits(name, input_objects, process_function, splits, num_workers, executor, order,
+                                                      checkpoint, cluster, **task_options)
+        elif executor == "distributed":
+            task_records = MapReduceEngine.run_splits(name, input_objects, process_function, [(0,input_len)], 1, executor, [0],
+                                                      checkpoint, cluster, **task_options)
+        elif checkpoint is not None and checkpoint.committed(name, 0, (0,input_len), list(input_objects)):
+            logger.info("{} stage skips its task committed by an earlier run".format(name))
+            task_records = []
+        else:
+            task_records = [MapReduceEngine.run_thread(name, 0, process_function, input_objects, **task_options)]
+            if checkpoint is not None:
+                checkpoint.commit(name, 0, (0,input_len), inputs=list(input_objects))
         end_time = time.time()
-        print("{} stage completed in {} seconds.".format(name,end_time - start_time)) 
+        if metrics is not None:
+            stage = metrics.addStage(name, executor, start_time, end_time, input_len, max(num_threads,1), max(num_workers,1),
+                                     storage_start, storage.stats(), task_records)
+            if stage.get("skew") is not None:
+                logger.debug("{} stage tasks took {:.3f} to {:.3f} seconds, skew {:.2f}".format(
+                    name, stage["task_seconds"]["min"], stage["task_seconds"]["max"], stage["skew"]))
+        logger.info("{} stage completed in {} seconds.".format(name,end_time - start_time))
         return max(abs(num_threads),1)
-    
-    def run_thread(name, threadID, process_function, input_objects):
-        print("{} thread {} is starting with {} objects ...".format(name, threadID, len(input_objects)))
-        process_function(threadID, input_objects)
-        print("{} thread {} is completed".format(name, threadID))
-        return
-        
+
+    def split_inputs(input_objects, split):
+        # input objects of a (start,end) split for its commit marker, None for a shuffle partition
+        if isinstance(split,int):
+            return None
+        return list(MapReduceEngine.get_split(input_objects, split))
+
+    def get_split(input_objects, split):
+        # split is either a (start,end) range or the index of an already split input
+        if isinstance(split,int):
+            return input_objects[split]
+        return input_objects[split[0]:split[1]]
+
+    def run_splits(name, input_objects, process_function, splits, num_workers, executor, order=None, checkpoint=None, cluster=None,
+                   **task_options):
+        # idle workers pull the next split in the given order
+        # each task is committed into checkpoint once it finished, the first failed task fails the stage
+        # returns the records of the tasks
+        order   = order if order is not None else range(len(splits))
+        context = task_options.get("context")
+        storage = context[0] if context is not None else getStorage()
+        if executor == "serial":
+            task_records = []
+            for ind in order:
+                task_records.append(MapReduceEngine.run_thread(name, ind, process_function,
+                                                               MapReduceEngine.get_split(input_objects, splits[ind]), **task_options))
+                if checkpoint is not None:
+                    checkpoint.commit(name, ind, splits[ind], inputs=MapReduceEngine.split_inputs(input_objects, splits[ind]))
+            return task_records
+        if executor == "distributed":
+            # workers read what the parent wrote from disk and write their outputs behind the back of its cache
+            storage.flush()
+            tasks = {ind: MapReduceEngine.get_split(input_objects, splits[ind]) for ind in order}
+            def on_done(ind, rec):
+                if checkpoint is not None:
+                    checkpoint.commit(name, ind, splits[ind], inputs=MapReduceEngine.split_inputs(input_objects, splits[ind]))
+            task_records = cluster.runStage(name, process_function, tasks, on_done=on_done, **task_options)
+            storage.clearCache()
+            return task_records
+        if executor == "threads":
+            pool     = concurrent.futures.ThreadPoolExecutor(max_workers=num_workers)
+            use_fork = False
+        else:
+            # worker processes read and write through their own cache --> parent's dirty objects must be on disk first
+            storage.flush()
+            use_fork = "fork" in multiprocessing.get_all_start_methods()
+            mp_context = multiprocessing.get_context("fork" if use_fork else None)
+            if use_fork:
+                # forked workers see the payload as is, only split boundaries are pickled
+                stage_key = uuid.uuid4().hex
+                _process_stage_payloads[stage_key] = (process_function, input_objects, storage)
+            if context is not None:
+                # the storage is not pickled, a forked worker takes it from the payload
+                task_options = dict(task_options, context=(None, context[1]))
+            pool     = concurrent.futures.ProcessPoolExecutor(max_workers=num_workers, mp_context=mp_context)
+        try:
+            with pool:
+                futures = {}
+                for ind in order:
+                    split = splits[ind]
+                    if executor == "threads":
+                        args = (MapReduceEngine.run_thread, name, ind, process_function, MapReduceEngine.get_split(input_objects, split))
+                    elif use_fork:
+                        args = (MapReduceEngine.run_process, name, ind, split, None, None, stage_key)
+                    else:
+                        # spawned workers: process_function must be importable (not defined in __main__)
+                        args = (MapReduceEngine.run_process, name, ind, split, process_function, MapReduceEngine.get_split(input_objects, split))
+                    futures[pool.submit(*args, **task_options)] = ind
+                task_records = []
+                done         = set()
+                try:
+                    for f in concurrent.futures.as_completed(futures):
+                        task_records.append(f.result())
+                        done.add(f)
+                        if checkpoint is not None:
+                            checkpoint.commit(name, futures[f], splits[futures[f]],
+                                                  inputs=MapReduceEngine.split_inputs(input_objects, splits[futures[f]]))
+                except BaseException:
+                    # not starting the waiting tasks of a failed stage, the running ones are committed when they succeed
+                    for f in futures:
+                        f.cancel()
+                    if checkpoint is not None:
+                        for f in futures:
+                            if f not in done and not f.cancelled() and f.exception() is None:
+                                checkpoint.commit(name, futures[f], splits[futures[f]],
+                                                  inputs=MapReduceEngine.split_inputs(input_objects, splits[futures[f]]))
+                    raise
+        finally:
+            if use_fork:
+                del _process_stage_payloads[stage_key]
+        if executor == "processes":
+            # workers changed objects on disk behind the back of the parent's cache
+            storage.clearCache()
+        return task_records
+
+    def run_process(name, threadID, split, process_function=None, input_objects=None, stage_key=None, context=None, **task_options):
+        storage = None
+        if stage_key is not None:
+            process_function, input_objects, storage = _process_stage_payloads[stage_key]
+            input_objects = MapReduceEngine.get_split(input_objects, split)
+        # spawned workers use their own default storage
+        storage = storage if storage is not None else getStorage()
+        context = (storage, context[1] if context is not None else "")
+        # the parent does not see the storage counters of this process --> they are returned with the task record
+        storage_start = storage.stats()
+        rec = MapReduceEngine.run_thread(name, threadID, process_function, input_objects, context=context, **task_options)
+        # worker processes do not run atexit handlers --> cached objects must be written now
+        storage.flush()
+        storage_end = storage.stats()
+        rec["storage"] = {key: value - storage_start.get(key,0) for key, value in storage_end.items()}
+        return rec
+
+    def run_thread(name, threadID, process_function, input_objects, profile=False, max_retries=0, context=None):
+        # returns the record of the task for JobMetrics, with the raw cProfile stats when profiling
+        # a failing task runs again up to max_retries times, then its exception is raised
+        # context: (storage, scratch namespace) of the job, set for this thread while the task runs
+        if context is not None:
+            previous = MapReduceEngine.set_context(context)
+            try:
+                return MapReduceEngine.run_thread(name, threadID, process_function, input_objects, profile, max_retries)
+            finally:
+                MapReduceEngine.set_context(previous)
+        if hasattr(input_objects,'__len__'):
+            logger.info("{} thread {} is starting with {} objects ...".format(name, threadID, len(input_objects)))
+        else:
+            logger.info("{} thread {} is starting with streamed objects ...".format(name, threadID))
+        start_time = time.time()
+        attempt    = 0
+        while True:
+            attempt += 1
+            if hasattr(input_objects,"rows_read"):
+                # rows of the successful attempt only
+                input_objects.rows_read = 0
+            try:
+                if profile:
+                    _, stats = JobMetrics.runProfiled(process_function, threadID, input_objects)
+                else:
+                    process_function(threadID, input_objects)
+                    stats = None
+                break
+            except Exception as e:
+                if attempt > max_retries:
+                    logger.error("{} thread {} failed after {} attempts: {!r}".format(name, threadID, attempt, e))
+                    raise
+                logger.warning("{} thread {} failed, retrying: {!r}".format(name, threadID, e), exc_info=True)
+        rec = JobMetrics.taskRecord(name, threadID, input_objects, start_time, time.time())
+        rec["attempts"] = attempt
+        if stats is not None:
+            rec["profile"] = stats
+        logger.info("{} thread {} is completed".format(name, threadID))
+        return rec
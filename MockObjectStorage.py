@@ -1,76 +1,350 @@
 import os
 import threading
 import atexit
+import mmap
+import weakref
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+import CachePolicy
 
-# implementing a thread safe LRU cache with dictionary
+KB = 2**10
+MB = KB*KB
+
+# implementing a thread safe cache with dictionary
+# the cache is split to shards, each with its own lock, so threads working on different objects do not wait for each other
+
+stat_names = ("hits", "misses", "evictions", "writebacks", "flushed", "prefetched")
+
+# bytes moved between the process and the disk, counted for all storages of the process
+io_stat_names = ("read_bytes", "written_bytes", "mapped_bytes")
+io_stats      = dict.fromkeys(io_stat_names,0)
+io_lock       = threading.Lock()
+
+def countIO(key, nbytes):
+    io_lock.acquire()
+    io_stats[key] += nbytes
+    io_lock.release()
+
+def resetIOLock():
+    global io_lock
+    io_lock = threading.Lock()
+
+if hasattr(os,"register_at_fork"):
+    os.register_at_fork(after_in_child=resetIOLock)
+
+# open storages, weakly referenced so a storage which is not used anymore can be freed
+# one exit hook writes their dirty objects, registered when this module is imported, so it runs after the exit hooks
+# of the modules using it (like the dirty files of VirtualBigFile), whenever the storages were created
+storages = weakref.WeakSet()
+
+def flushStorages():
+    for storage in list(storages):
+        storage.flush()
+
+def afterForkStorages():
+    for storage in list(storages):
+        storage.__afterFork__()
+
+atexit.register(flushStorages)
+if hasattr(os,"register_at_fork"):
+    os.register_at_fork(after_in_child=afterForkStorages)
+
+class CacheBudget:
+    '''Capacity of a whole cache, shared by its shards: a working set under the limits stays cached
+    whichever shards its names fall into, an object up to the whole byte capacity fits'''
+    def __init__(self, capacity, capacity_bytes):
+        self.capacity       = capacity       # max number of objects, 0 for unlimited
+        self.capacity_bytes = capacity_bytes # max bytes of objects, 0 for unlimited
+        self.count          = 0              # objects in all shards
+        self.size           = 0              # bytes of objects in all shards
+        self.lock           = threading.Lock()
+
+    def add(self, count, size):
+        self.lock.acquire()
+        self.count += count
+        self.size  += size
+        self.lock.release()
+
+    def full(self):
+        return self.capacity > 0 and self.count > self.capacity or\
+        self.capacity_bytes > 0 and self.size > self.capacity_bytes
+
+class CacheShard:
+    def __init__(self, budget, policy):
+        self.budget         = budget         # capacity of the whole cache
+        self.nodes          = {}             # name --> [data, dirty]
+        self.policy         = policy()       # eviction order of the names in nodes
+        self.size           = 0              # bytes of objects in nodes
+        self.loading        = {}             # name --> Future of a disk read in progress
+        self.stats          = dict.fromkeys(stat_names,0)
+        self.lock           = threading.Lock()
+
+    def full(self):
+        return self.budget.full()
+
+    def pop(self, name):
+        node = self.nodes.pop(name,None)
+        if node is not None:
+            self.size -= len(node[0])
+            self.budget.add(-1,-len(node[0]))
+            self.policy.remove(name)
+        return node
+
+class WriteBehind:
+    '''Background writing of dirty objects by a pool of threads
+    Writers are blocked while more than max_dirty_bytes wait to be written (backpressure).
+    Writes of the same name are chained so the last written data wins.'''
+    def __init__(self, num_threads, max_dirty_bytes):
+        self.num_threads     = num_threads
+        self.max_dirty_bytes = max_dirty_bytes
+        self.pool            = ThreadPoolExecutor(max_workers=num_threads, thread_name_prefix="WriteBehind")
+        self.pending         = {} # name --> [data, Future] of the last write of name
+        self.dirty_bytes     = 0
+        self.cond            = threading.Condition()
+
+    def write(self, name, data):
+        if len(data) < 1:
+            return
+        self.cond.acquire()
+        while self.dirty_bytes > 0 and self.dirty_bytes + len(data) > self.max_dirty_bytes:
+            self.cond.wait()
+        prev  = self.pending.get(name)
+        entry = [data, None]
+        self.pending[name] = entry
+        self.dirty_bytes  += len(data)
+        try:
+            entry[1] = self.pool.submit(self.__run__, name, entry, prev)
+        except RuntimeError:
+            # interpreter shutdown (atexit flush) --> writing in the calling thread
+            entry[1] = Future()
+            self.cond.release()
+            self.__run__(name, entry, prev)
+            entry[1].set_result(None)
+            return
+        self.cond.release()
+
+    def __run__(self, name, entry, prev):
+        try:
+            if prev is not None:
+                prev[1].result()
+            MockObjectStorage.__writeFile__(name,entry[0])
+        finally:
+            self.cond.acquire()
+            self.dirty_bytes -= len(entry[0])
+            if self.pending.get(name) is entry:
+                del self.pending[name]
+            self.cond.notify_all()
+            self.cond.release()
+
+    def get(self, name):
+        # data of a write in progress, None if name is not being written
+        self.cond.acquire()
+        entry = self.pending.get(name)
+        self.cond.release()
+        return None if entry is None else entry[0]
+
+    def wait(self, names=None):
+        # barrier: waiting for the writes of names (all writes when None) that were issued before
+        self.cond.acquire()
+        if names is None:
+            entries = list(self.pending.values())
+        else:
+            entries = [self.pending[name] for name in names if name in self.pending]
+        self.cond.release()
+        for entry in entries:
+            entry[1].result()
 
 class MockObjectStorage:
-    def __init__(self, MaxCachedFiles=32):
+    def __init__(self, MaxCachedFiles=32, NumShards=8, MaxCachedBytes=0, Policy="lru", WriteThreads=4, MaxDirtyBytes=64*MB,
+                 ReadThreads=8):
+        '''MaxCachedFiles: cache capacity in objects, 0 disables the cache
+        MaxCachedBytes: cache capacity in bytes, replaces the count limit when given
+        Policy: eviction policy "lru", "2q" (scan resistant) or "tinylfu", or a class from CachePolicy
+        WriteThreads: threads writing evicted and flushed dirty objects in the background, 0 writes in the caller
+        MaxDirtyBytes: bytes waiting for the write threads before writers are blocked
+        ReadThreads: threads reading the objects of a list concurrently and prefetching objects, 0 reads in the caller'''
         self.MaxCachedFiles = MaxCachedFiles
+        self.ReadThreads    = ReadThreads
+        self.readPool       = ThreadPoolExecutor(max_workers=ReadThreads, thread_name_prefix="ObjectStorageRead") if ReadThreads > 0 else None
         if MaxCachedFiles > 0:
-            self.cache  = {}
-            self.oldest = None
-            self.newest = None
-            self.lock   = threading.Lock()
-            atexit.register(self.flush)
-        
+            policy = CachePolicy.policies[Policy] if isinstance(Policy,str) else Policy
+            if MaxCachedBytes > 0:
+                capacity       = 0
+                capacity_bytes = MaxCachedBytes
+            else:
+                NumShards      = max(min(NumShards,MaxCachedFiles),1)
+                capacity       = MaxCachedFiles
+                capacity_bytes = 0
+            budget      = CacheBudget(capacity,capacity_bytes)
+            self.shards = [CacheShard(budget,policy) for _ in range(NumShards)]
+            self.writer = WriteBehind(WriteThreads,MaxDirtyBytes) if WriteThreads > 0 else None
+        storages.add(self)
+
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        # a storage which is not referenced anymore is freed with its threads, its dirty objects are written first
+        if hasattr(self,"readPool"):
+            self.close()
+
+    def close(self):
+        '''Writes the dirty objects, drops the cache and stops the read and write threads
+        A closed storage keeps working without a cache, reading and writing the disk in the calling thread'''
         if self.MaxCachedFiles > 0:
-            self.flush()
-        
+            self.clearCache()
+            if self.writer is not None:
+                self.writer.pool.shutdown()
+                self.writer = None
+            self.MaxCachedFiles = 0
+        if self.readPool is not None:
+            self.readPool.shutdown()
+            self.readPool    = None
+            self.ReadThreads = 0
+        storages.discard(self)
+
+    def shardOf(self, name):
+        return self.shards[zlib.crc32(name.encode()) % len(self.shards)]
+
     def createObject(self, names, datas):
         if self.MaxCachedFiles > 0:
-            self.lock.acquire()
-            self.__appendData2Cache__(names,datas,True)
-            self.lock.release()
+            if not isinstance(names,list):
+                names = [names]
+                datas = [datas]
+            for name,data in zip(names,datas):
+                shard = self.shardOf(name)
+                shard.lock.acquire()
+                # a disk read in progress must not override the new data
+                shard.loading.pop(name,None)
+                self.__appendData2Cache__(shard,name,data,True)
+                shard.lock.release()
         else:
             self.__writeData__(names,datas)
 
+    def appendObject(self, name, data):
+        '''Appends bytes at the end of an object on disk without rewriting it, for append only objects like indexes
+        The cached copy is dropped, memory maps of the object keep seeing its old length'''
+        if self.MaxCachedFiles < 1:
+            MockObjectStorage.__appendFile__(name,data)
+            return
+        shard = self.shardOf(name)
+        shard.lock.acquire()
+        shard.loading.pop(name,None)
+        node = shard.pop(name)
+        if self.writer is not None:
+            # a background write of the old data must not override the appended data
+            self.writer.wait([name])
+        if node is not None and node[1]:
+            # the object was never written --> writing it whole
+            MockObjectStorage.__writeFile__(name,bytes(node[0]) + bytes(data))
+        else:
+            MockObjectStorage.__appendFile__(name,data)
+        shard.lock.release()
+
+    def writeObject(self, name, data):
+        '''Replaces the object on disk at once (atomically) and keeps the new data in the cache, for objects which
+        must be durable before the next step, like a new catalog base before its log is deleted'''
+        if self.MaxCachedFiles < 1:
+            self.__writeData__(name,data)
+            return
+        if isinstance(data,str) or isinstance(data,list):
+            data = MockObjectStorage.convertStr2Bytes(data)
+        shard = self.shardOf(name)
+        shard.lock.acquire()
+        shard.loading.pop(name,None)
+        shard.pop(name)
+        if self.writer is not None:
+            # a background write of the old data must not override the new data
+            self.writer.wait([name])
+        MockObjectStorage.__writeFile__(name,data)
+        self.__appendData2Cache__(shard,name,data,False)
+        shard.lock.release()
+
+    def claimObject(self, name, data):
+        '''Creates the object on disk only when it does not exist yet, atomically also between processes and hosts sharing
+        the directory. Returns False when it exists. For locks and leases: the object does not enter the cache'''
+        try:
+            fd = os.open(name, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os,"O_BINARY",0))
+        except FileExistsError:
+            return False
+        with os.fdopen(fd,"wb") as f:
+            f.write(data)
+        countIO("written_bytes",len(data))
+        return True
+
     def readObject(self, names, type_=None):
         islist = isinstance(names,list)
         if not islist:
             names = [names]
-        res = []
-        if self.MaxCachedFiles > 0:
-            self.lock.acquire()
-        for name in names:
-            if self.MaxCachedFiles < 1 or name not in self.cache:
-                # new object does not exists in cache --> read it and append into cache
-                if not os.path.isfile(name):
-                    res.append(None)
-                    continue
-                with open(name,"rb") as f:
-                    data = f.read()
-                if self.MaxCachedFiles > 0:
-                    self.__appendData2Cache__(name,data,False)
-                res.append(data)
-                continue
-            # new object already exists in cache
-            data_node     = self.cache[name]
-            if self.newest != name:
-                # this node is not newest --> cache needs to be updated
-                old_data_next = data_node[2]
-                old_data_prev = data_node[3]
-                data_node[2]  = None
-                data_node[3]  = self.newest
-                self.cache[self.newest][2] = name
-                self.newest   = name
-                self.cache[old_data_next][3] = old_data_prev
-                if self.oldest == name:
-                    self.oldest = old_data_next
-                else:
-                    self.cache[old_data_prev][2] = old_data_next
-            res.append(data_node[0])
-        if self.MaxCachedFiles > 0:
-            self.lock.release()
+        if len(names) > 1 and self.ReadThreads > 0:
+            # paying the latency of one object for all of them, not one after another
+            res = list(self.readPool.map(self.__readOne__,names))
+        else:
+            res = [self.__readOne__(name) for name in names]
         if type_ is not None:
             # convert all bytes arrays into strings
             res = [MockObjectStorage.convertBytes2Str(r,type_) if isinstance(r, bytes) else r for r in res]
         return res if islist or len(res) > 1 else res[0]
-    
+
+    def prefetchObject(self, names):
+        '''Read ahead: starts reading the objects into cache in the background and returns at once
+        Objects already cached or being read are skipped'''
+        if self.MaxCachedFiles < 1 or self.ReadThreads < 1:
+            return
+        if not isinstance(names,list):
+            names = [names]
+        for name in names:
+            shard = self.shardOf(name)
+            shard.lock.acquire()
+            if name in shard.nodes or name in shard.loading:
+                shard.lock.release()
+                continue
+            # registered before submitting, so readers arriving meanwhile wait for this read
+            loading = Future()
+            shard.loading[name] = loading
+            shard.stats["prefetched"] += 1
+            shard.lock.release()
+            self.readPool.submit(self.__load__,shard,name,loading)
+
+    def mapObject(self, name, prefetch=False):
+        '''Zero copy read: memoryview over the cached data or over a read only memory map of the file
+        The file is mapped without entering the cache, None if the object does not exist
+        prefetch: asks the OS to start reading the whole mapped file ahead'''
+        if self.MaxCachedFiles > 0:
+            shard = self.shardOf(name)
+            shard.lock.acquire()
+            node  = shard.nodes.get(name)
+            if node is not None:
+                shard.policy.touch(name)
+                shard.stats["hits"] += 1
+                shard.lock.release()
+                return memoryview(node[0])
+            shard.stats["misses"] += 1
+            loading = shard.loading.get(name)
+            shard.lock.release()
+            if loading is not None:
+                # a prefetch or another reader is already reading this object --> no second read from disk
+                data = loading.result()
+                return memoryview(data) if data is not None else None
+            data = self.writer.get(name) if self.writer is not None else None
+            if data is not None:
+                return memoryview(data)
+        # read without a lock: the object may be deleted at any moment
+        try:
+            with open(name,"rb") as f:
+                if os.fstat(f.fileno()).st_size < 1:
+                    return memoryview(b'')
+                mapped = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
+        countIO("mapped_bytes",len(mapped))
+        if prefetch and hasattr(mapped,"madvise") and hasattr(mmap,"MADV_WILLNEED"):
+            mapped.madvise(mmap.MADV_WILLNEED)
+        return memoryview(mapped)
+
     def deleteObject(self, names):
         if not isinstance(names,list):
             names = [names]
@@ -79,75 +353,235 @@ class MockObjectStorage:
                 if os.path.exists(name):
                     os.remove(name)
             return
-        self.lock.acquire()
         for name in names:
-            deleteFromDisk = True
-            if name in self.cache:
-                data_node = self.cache[name]
-                old_data_next = data_node[2]
-                old_data_prev = data_node[3]
-                if self.oldest == name:
-                    self.oldest = old_data_next
-                else:
-                    self.cache[old_data_prev][2] = old_data_next
-                if self.newest == name:
-                    self.newest = old_data_prev
-                else:
-                    self.cache[old_data_next][3] = old_data_prev
-                deleteFromDisk = not data_node[1]
-                del self.cache[name]
+            shard = self.shardOf(name)
+            shard.lock.acquire()
+            shard.loading.pop(name,None)
+            node = shard.pop(name)
+            deleteFromDisk = node is None or not node[1]
+            if self.writer is not None:
+                # a background write must not bring the object back after deleting it
+                self.writer.wait([name])
             if deleteFromDisk and os.path.exists(name):
                 os.remove(name)
-        self.lock.release()
-    
+            shard.lock.release()
+
+    def listObjects(self, prefix=""):
+        # sorted names of the objects starting with prefix, on disk or only in the cache
+        directory, start = os.path.split(prefix)
+        names = set()
+        if os.path.isdir(directory or os.curdir):
+            for entry in os.listdir(directory or os.curdir):
+                parts = entry.split('.')
+                # temporary file of a write in progress, see __writeFile__
+                if len(parts) > 2 and parts[-1] == "tmp" and parts[-2].isdigit():
+                    continue
+                if entry.startswith(start) and os.path.isfile(os.path.join(directory,entry)):
+                    names.add(os.path.join(directory,entry))
+        if self.MaxCachedFiles > 0:
+            for shard in self.shards:
+                shard.lock.acquire()
+                names.update(name for name in shard.nodes if name.startswith(prefix))
+                shard.lock.release()
+            if self.writer is not None:
+                self.writer.cond.acquire()
+                names.update(name for name in self.writer.pending if name.startswith(prefix))
+                self.writer.cond.release()
+        return sorted(names)
+
     def flush(self, names=None):
+        # barrier: returns when all dirty objects (of names) are on disk
         if self.MaxCachedFiles < 1:
             return
-        self.lock.acquire()
-        for key in self.cache:
-            node = self.cache[key]
-            if not node[1]:
-                continue
-            if names is not None and key not in names:
+        for shard in self.shards:
+            shard.lock.acquire()
+            for key, node in shard.nodes.items():
+                if not node[1]:
+                    continue
+                if names is not None and key not in names:
+                    continue
+                self.__writeBack__(key,node[0])
+                node[1] = False
+                shard.stats["flushed"] += 1
+            shard.lock.release()
+        if self.writer is not None:
+            self.writer.wait(names)
+
+    def stats(self):
+        # counters summed over all shards, the current cache occupation and the disk bytes of the process
+        res = dict.fromkeys(stat_names,0)
+        res["cached_objects"] = 0
+        res["cached_bytes"]   = 0
+        io_lock.acquire()
+        res.update(io_stats)
+        io_lock.release()
+        if self.MaxCachedFiles < 1:
+            return res
+        for shard in self.shards:
+            shard.lock.acquire()
+            for key in stat_names:
+                res[key] += shard.stats[key]
+            res["cached_objects"] += len(shard.nodes)
+            res["cached_bytes"]   += shard.size
+            shard.lock.release()
+        return res
+
+    def resetStats(self):
+        io_lock.acquire()
+        for key in io_stat_names:
+            io_stats[key] = 0
+        io_lock.release()
+        if self.MaxCachedFiles < 1:
+            return
+        for shard in self.shards:
+            shard.lock.acquire()
+            shard.stats = dict.fromkeys(stat_names,0)
+            shard.lock.release()
+
+    def clearCache(self):
+        # writing all dirty objects and dropping the whole cache so next reads come from disk
+        # needed when other processes may have changed the objects on disk
+        if self.MaxCachedFiles < 1:
+            return
+        for shard in self.shards:
+            shard.lock.acquire()
+            for key in list(shard.nodes):
+                node = shard.pop(key)
+                if node[1]:
+                    self.__writeBack__(key,node[0])
+            shard.lock.release()
+        if self.writer is not None:
+            self.writer.wait()
+
+    def __readOne__(self, name):
+        if self.MaxCachedFiles < 1:
+            return MockObjectStorage.__readFile__(name)
+        shard = self.shardOf(name)
+        shard.lock.acquire()
+        node  = shard.nodes.get(name)
+        if node is not None:
+            # object already exists in cache
+            shard.policy.touch(name)
+            shard.stats["hits"] += 1
+            shard.lock.release()
+            return node[0]
+        shard.stats["misses"] += 1
+        loading = shard.loading.get(name)
+        if loading is not None:
+            # another thread is already reading this object from disk --> waiting for its result
+            shard.lock.release()
+            return loading.result()
+        loading = Future()
+        shard.loading[name] = loading
+        shard.lock.release()
+        return self.__load__(shard,name,loading)
+
+    def __load__(self, shard, name, loading):
+        # reading from disk without holding the lock, loading is the Future of this read in shard.loading
+        try:
+            data = self.writer.get(name) if self.writer is not None else None
+            if data is None:
+                data = MockObjectStorage.__readFile__(name)
+        except BaseException as e:
+            shard.lock.acquire()
+            if shard.loading.get(name) is loading:
+                del shard.loading[name]
+            shard.lock.release()
+            loading.set_exception(e)
+            raise
+        shard.lock.acquire()
+        if shard.loading.get(name) is loading:
+            # object was not created or deleted meanwhile --> append it into cache
+            del shard.loading[name]
+            if data is not None:
+                self.__appendData2Cache__(shard,name,data,False)
+        shard.lock.release()
+        loading.set_result(data)
+        return data
+
+    def __appendData2Cache__(self, shard, name, data, status):
+        # shard lock must be held by the caller
+        assert name not in shard.nodes
+        is_str = isinstance(data,str) or isinstance(data,list)
+        assert not is_str or isinstance(data,str) or\
+        isinstance(data,list) and (isinstance(data[0],str) or isinstance(data[0],tuple))
+        if is_str:
+            data = MockObjectStorage.convertStr2Bytes(data)
+        shard.nodes[name] = [data,status]
+        shard.size += len(data)
+        shard.budget.add(1,len(data))
+        shard.policy.insert(name)
+        while shard.full() and len(shard.nodes) > 0:
+            # removing the victim of the policy from cache, it can be the new object itself
+            # when the new object is alone in its shard, the victim is taken from another shard
+            if len(shard.nodes) > 1 or not self.__evictOther__(shard):
+                self.__evict__(shard,shard.policy.victim(name))
+
+    def __evict__(self, shard, victim_name):
+        # shard lock must be held by the caller
+        victim_node = shard.nodes.pop(victim_name)
+        shard.size -= len(victim_node[0])
+        shard.budget.add(-1,-len(victim_node[0]))
+        shard.stats["evictions"] += 1
+        if victim_node[1]:
+            self.__writeBack__(victim_name,victim_node[0])
+            shard.stats["writebacks"] += 1
+
+    def __evictOther__(self, shard):
+        # evicting the victim of the fullest other shard, False when there is none
+        # a busy shard is skipped: waiting for its lock while holding this one could deadlock
+        for other in sorted(self.shards, key=lambda other: -other.size):
+            if other is shard or len(other.nodes) < 1 or not other.lock.acquire(blocking=False):
                 continue
-            self.__writeData__(key,node[0])
-            node[1] = False
-        self.lock.release()
-        
-    def __appendData2Cache__(self, names, datas, status):
-        if isinstance(names,list):
-            assert isinstance(datas,list)
-            assert len(datas) == len(names)
-            is_str = isinstance(datas[0],str) or isinstance(datas[0],list)
+            evicted = len(other.nodes) > 0
+            if evicted:
+                self.__evict__(other,other.policy.victim())
+            other.lock.release()
+            if evicted:
+                return True
+        return False
+
+    def __writeBack__(self, name, data):
+        if self.writer is not None:
+            self.writer.write(name,data)
         else:
-            is_str = isinstance(datas,str) or isinstance(datas,list)
-            assert not is_str or isinstance(datas,str) or\
-            isinstance(datas,list) and (isinstance(datas[0],str) or isinstance(datas[0],tuple))
-            names  = [names]
-            datas  = [datas]
-        for name,data in zip(names,datas):
-            assert name not in self.cache
-            if is_str:
-                data = MockObjectStorage.convertStr2Bytes(data)
-            prev_newest = self.newest
-            self.cache[name] = [data,status,None,prev_newest]
-            self.newest = name
-            if self.oldest is None:
-                self.oldest = name
-                return
-            if prev_newest is not None:
-                self.cache[prev_newest][2] = name
-            if len(self.cache) <= self.MaxCachedFiles:
-                return
-            # removing oldest data from cache
-            prev_oldest_name = self.oldest
-            prev_oldest_node = self.cache[prev_oldest_name]
-            self.oldest = prev_oldest_node[2]
-            self.cache[self.oldest][3] = None
-            if prev_oldest_node[1]:
-                self.__writeData__(prev_oldest_name,prev_oldest_node[0])
-            del self.cache[prev_oldest_name]
-        
+            self.__writeData__(name,data)
+
+    def __afterFork__(self):
+        # a forked child has only the forking thread --> locks, write and read threads of the parent are unusable
+        if self.MaxCachedFiles > 0:
+            self.shards[0].budget.lock = threading.Lock()
+            for shard in self.shards:
+                shard.lock    = threading.Lock()
+                shard.loading = {}
+            if self.writer is not None:
+                self.writer = WriteBehind(self.writer.num_threads,self.writer.max_dirty_bytes)
+        if self.readPool is not None:
+            self.readPool = ThreadPoolExecutor(max_workers=self.ReadThreads, thread_name_prefix="ObjectStorageRead")
+
+    def __readFile__(name):
+        # read without a lock: the object may be deleted at any moment
+        try:
+            with open(name,"rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        countIO("read_bytes",len(data))
+        return data
+
+    def __writeFile__(name, data):
+        # replacing the file instead of overwriting it, memory maps of the old file stay valid
+        temp_name = "{}.{}.tmp".format(name,threading.get_ident())
+        with open(temp_name,"wb") as f:
+            f.write(data)
+        os.replace(temp_name,name)
+        countIO("written_bytes",len(data))
+
+    def __appendFile__(name, data):
+        with open(name,"ab") as f:
+            f.write(data)
+        countIO("written_bytes",len(data))
+
     def __writeData__(self,names,datas):
         if isinstance(names,list):
             assert isinstance(datas,list)
@@ -163,8 +597,7 @@ class MockObjectStorage:
                 continue
             if is_str:
                 data = MockObjectStorage.convertStr2Bytes(data)
-            with open(name,"wb") as f:
-                f.write(data)
+            MockObjectStorage.__writeFile__(name,data)
         return
         
     def convertStr2Bytes(str_):
@@ -181,7 +614,8 @@ class MockObjectStorage:
         return datarows.encode('ASCII')
     
     def convertBytes2Str(bytes_, type_=str):
-        res     = bytes_.decode('ASCII').replace('\r\n','\n')
+        # any bytes-like object, for example a memoryview slice of a partition
+        res     = str(bytes_,'ASCII').replace('\r\n','\n')
         is_list = isinstance(type_,list)
         if not is_list:
             assert type_ == str
@@ -0,0 +1,118 @@
+from array import array
+from bisect import bisect_right
+import struct
+
+# binary index of the partitions of a VirtualBigFile, replaces the old <name>.index.csv
+# index: header | metadata | end location of each partition
+#   header: magic, metadata length in bytes (padded to 8 bytes)
+#   metadata: utf-8 rows like #format,columnar,name:type or #codec,zlib, one per line
+#   end locations: native uint64 exclusive end of each partition in the virtual file, partition i is file number i
+# opening maps the index without parsing it and new partitions are appended at its end
+
+MAGIC  = b'VBI1'
+HEADER = struct.Struct('<4sI')
+
+class PartitionIndex:
+    smallIndexBytes = 64*1024 # smaller indexes are copied instead of keeping their memory map (and its file descriptor)
+
+    def __init__(self, objectStorage, name, view=None):
+        # view: the index object when it was already read, an empty view when it does not exist
+        self.objectStorage = objectStorage
+        self.name          = name
+        self.metadata      = []                # rows of the header, lists of str
+        self.mapped        = array('Q')        # end locations on disk when opening, a view over the mapped index
+        self.appended      = array('Q')        # end locations added after opening
+        self.num_written   = 0                 # of appended, already on disk
+        self.written_meta  = None              # metadata on disk, None if there is no index on disk
+        if view is None:
+            view = objectStorage.mapObject(name)
+        if view is not None and len(view) >= HEADER.size:
+            if len(view) <= PartitionIndex.smallIndexBytes:
+                view = memoryview(bytes(view))
+            magic, meta_len = HEADER.unpack_from(view,0)
+            assert magic == MAGIC, "{} is not a partition index".format(name)
+            meta_start   = HEADER.size
+            data_start   = meta_start + meta_len
+            text         = bytes(view[meta_start:data_start]).rstrip(b'\0').decode('utf-8')
+            self.metadata     = [row.split(',') for row in text.split('\n') if len(row) > 0]
+            self.written_meta = [list(row) for row in self.metadata]
+            self.mapped       = view[data_start:].cast('Q')
+
+    def exists(self):
+        return self.written_meta is not None
+
+    def __len__(self):
+        return len(self.mapped) + len(self.appended)
+
+    def end(self, ind):
+        # exclusive end of partition ind
+        if ind < len(self.mapped):
+            return self.mapped[ind]
+        return self.appended[ind - len(self.mapped)]
+
+    def start(self, ind):
+        return self.end(ind-1) if ind > 0 else 0
+
+    def size(self, ind):
+        return self.end(ind) - self.start(ind)
+
+    def totalSize(self):
+        return self.end(len(self)-1) if len(self) > 0 else 0
+
+    def locate(self, pos):
+        # index of the partition holding location pos, len(self) if pos is after the last partition
+        if len(self.mapped) > 0 and pos < self.mapped[-1]:
+            return bisect_right(self.mapped, pos)
+        return len(self.mapped) + bisect_right(self.appended, pos)
+
+    def append(self, size):
+        self.appended.append(self.totalSize() + size)
+
+    def flush(self, batch=None):
+        # new end locations are appended to the index on disk, the whole index is written only when it is new
+        # or when its metadata changed
+        # batch: list collecting (name, data) of the new index instead of creating it now
+        if self.written_meta == self.metadata:
+            if self.num_written < len(self.appended):
+                self.objectStorage.appendObject(self.name, self.appended[self.num_written:].tobytes())
+                self.num_written = len(self.appended)
+            return
+        if self.exists():
+            self.objectStorage.deleteObject(self.name)
+        text     = '\n'.join(','.join(row) for row in self.metadata).encode('utf-8')
+        text    += b'\0' * (-(HEADER.size + len(text)) % 8)
+        ends     = array('Q',self.mapped)
+        ends.extend(self.appended)
+        data     = HEADER.pack(MAGIC,len(text)) + text + ends.tobytes()
+        if batch is not None:
+            batch.append((self.name,data))
+        else:
+            self.objectStorage.createObject(self.name, data)
+        self.num_written  = len(self.appended)
+        self.written_meta = [list(row) for row in self.metadata]
+
+    def delete(self, batch=None):
+        # batch: list collecting the name of the index instead of deleting it now
+        if self.exists():
+            if batch is not None:
+                batch.append(self.name)
+            else:
+                self.objectStorage.deleteObject(self.name)
+        self.metadata     = []
+        self.mapped       = array('Q')
+        self.appended     = array('Q')
+        self.num_written  = 0
+        self.written_meta = None
+
+    def totalSizeOf(objectStorage, name):
+        # size of the virtual file from its index without opening it: only the header and the last end location are read
+        # None if there is no index
+        view = objectStorage.mapObject(name)
+        if view is None or len(view) < HEADER.size:
+            return None
+        magic, meta_len = HEADER.unpack_from(view,0)
+        assert magic == MAGIC, "{} is not a partition index".format(name)
+        data_start = HEADER.size + meta_len
+        if len(view) < data_start + 8:
+            return 0
+        return view[(len(view)-8):].cast('Q')[0]
@@ -0,0 +1,215 @@
+from array import array
+from bisect import bisect_left
+import struct
+import zlib
+
+# catalog of a SmallFilesContainer: file name --> [partition, start, end, is_str]
+# base object <name>.catalog, written by merge() and memory mapped on open:
+#   header: magic, number of files, bytes of names
+#   columns: name hashes (uint64, sorted) | name offsets (uint64, number of files + 1) |
+#            partitions, starts, ends (uint32) | is_str (uint8) | utf-8 names one after another
+# log object <name>.catalog.log, changes after the base appended by flush():
+#   records: partition, start, end, is_str (DELETED for a deleted file), name length | utf-8 name
+# open reads the log only, it is merged into a new base once it has maxLogEntries records
+# lookups are safe without a lock while one writer changes the catalog: the base is replaced as a whole
+# and the changes after it are a dict
+
+MAGIC      = b'SFC1'
+HEADER     = struct.Struct('<4sIQQ')
+LOG_RECORD = struct.Struct('<IIIBH')
+DELETED    = 255
+
+def nameHash(name_bytes):
+    return zlib.crc32(name_bytes) << 32 | zlib.adler32(name_bytes)
+
+class CatalogBase:
+    '''Sorted columns of a catalog base over its mapped object, never changed after creation'''
+    def __init__(self, view, name):
+        self.count = 0
+        self.hashes = array('Q')
+        if view is None or len(view) < HEADER.size:
+            return
+        magic, reserved, count, names_size = HEADER.unpack_from(view,0)
+        assert magic == MAGIC, "{} is not a catalog".format(name)
+        pos = HEADER.size
+        def column(type_, length, size):
+            nonlocal pos
+            col  = view[pos:(pos + length*size)].cast(type_)
+            pos += length*size
+            return col
+        self.count      = count
+        self.hashes     = column('Q', count, 8)
+        self.offsets    = column('Q', count + 1, 8)
+        self.partitions = column('I', count, 4)
+        self.starts     = column('I', count, 4)
+        self.ends       = column('I', count, 4)
+        self.types      = column('B', count, 1)
+        self.names      = view[pos:(pos + names_size)]
+
+    def find(self, name):
+        # index of name, -1 if it is not there
+        name_bytes = name.encode('utf-8')
+        hash_      = nameHash(name_bytes)
+        ind        = bisect_left(self.hashes, hash_)
+        while ind < self.count and self.hashes[ind] == hash_:
+            if self.names[self.offsets[ind]:self.offsets[ind+1]] == name_bytes:
+                return ind
+            ind += 1
+        return -1
+
+    def name(self, ind):
+        return bytes(self.names[self.offsets[ind]:self.offsets[ind+1]]).decode('utf-8')
+
+    def record(self, ind):
+        return [self.partitions[ind], self.starts[ind], self.ends[ind], self.types[ind]]
+
+class SmallFilesCatalog:
+    maxLogEntries = 65536
+
+    def __init__(self, objectStorage, name):
+        self.objectStorage = objectStorage
+        self.base_name     = name + ".catalog"
+        self.log_name      = name + ".catalog.log"
+        self.delta         = {}    # changes after the base: name --> record, None for a deleted file
+        self.unflushed     = set() # names changed after the last flush
+        self.log_entries   = 0     # records in the log object
+        self.base          = CatalogBase(objectStorage.mapObject(self.base_name), self.base_name)
+        self.count         = self.base.count
+        view = objectStorage.mapObject(self.log_name)
+        pos  = 0
+        while view is not None and pos < len(view):
+            partition, start, end, is_str, name_len = LOG_RECORD.unpack_from(view,pos)
+            pos += LOG_RECORD.size
+            name = bytes(view[pos:(pos + name_len)]).decode('utf-8')
+            pos += name_len
+            self.__setRecord__(name, None if is_str == DELETED else [partition,start,end,is_str])
+            self.log_entries += 1
+        self.unflushed.clear()
+
+    def get(self, name, default=None):
+        # the delta is read before the base: merge() replaces the base before the delta
+        delta = self.delta
+        base  = self.base
+        if name in delta:
+            rec = delta.get(name)
+        else:
+            ind = base.find(name)
+            rec = base.record(ind) if ind >= 0 else None
+        return list(rec) if rec is not None else default
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __getitem__(self, name):
+        rec = self.get(name)
+        if rec is None:
+            raise KeyError(name)
+        return rec
+
+    def __setitem__(self, name, rec):
+        self.__setRecord__(name, list(rec))
+
+    def __delitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        self.__setRecord__(name, None)
+
+    def __setRecord__(self, name, rec):
+        existed = name in self
+        self.delta[name] = rec
+        self.unflushed.add(name)
+        self.count += int(rec is not None) - int(existed)
+
+    def __len__(self):
+        return self.count
+
+    def items(self):
+        # snapshot of the catalog when starting, later changes are not seen
+        delta = self.delta
+        base  = self.base
+        delta = dict(delta)
+        for ind in range(base.count):
+            name = base.name(ind)
+            if name not in delta:
+                yield name, base.record(ind)
+        for name, rec in delta.items():
+            if rec is not None:
+                yield name, list(rec)
+
+    def keys(self):
+        for name, _ in self.items():
+            yield name
+
+    def __iter__(self):
+        return self.keys()
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def exists(self):
+        return self.base.count > 0 or self.log_entries > 0 or len(self.delta) > 0
+
+    def flush(self):
+        # appending the changed records to the log, or merging everything into a new base when the log is long
+        if len(self.unflushed) < 1:
+            return
+        if self.log_entries + len(self.unflushed) > SmallFilesCatalog.maxLogEntries:
+            self.merge()
+            return
+        self.__appendLog__()
+
+    def __appendLog__(self):
+        if len(self.unflushed) < 1:
+            return
+        records = []
+        for name in self.unflushed:
+            rec        = self.delta[name]
+            name_bytes = name.encode('utf-8')
+            if rec is None:
+                records.append(LOG_RECORD.pack(0,0,0,DELETED,len(name_bytes)))
+            else:
+                records.append(LOG_RECORD.pack(rec[0],rec[1],rec[2],rec[3],len(name_bytes)))
+            records.append(name_bytes)
+        self.objectStorage.appendObject(self.log_name, b''.join(records))
+        self.log_entries += len(self.unflushed)
+        self.unflushed.clear()
+
+    def merge(self):
+        # writing all live records into a new sorted base and dropping the log
+        # the log gets the changes which were not flushed first: the new base with the old log reads the same catalog,
+        # so a process stopping before the log is deleted loses nothing
+        self.__appendLog__()
+        entries = [(nameHash(name.encode('utf-8')), name.encode('utf-8'), rec) for name, rec in self.items()]
+        entries.sort(key=lambda entry: entry[0])
+        hashes     = array('Q')
+        offsets    = array('Q',[0])
+        partitions = array('I')
+        starts     = array('I')
+        ends       = array('I')
+        types      = array('B')
+        names      = bytearray()
+        for hash_, name_bytes, rec in entries:
+            hashes.append(hash_)
+            names += name_bytes
+            offsets.append(len(names))
+            partitions.append(rec[0])
+            starts.append(rec[1])
+            ends.append(rec[2])
+            types.append(rec[3])
+        data = b''.join([HEADER.pack(MAGIC,0,len(entries),len(names)), hashes.tobytes(), offsets.tobytes(),
+                         partitions.tobytes(), starts.tobytes(), ends.tobytes(), types.tobytes(), bytes(names)])
+        self.objectStorage.writeObject(self.base_name, data)
+        self.objectStorage.deleteObject(self.log_name)
+        self.base        = CatalogBase(memoryview(data), self.base_name)
+        self.delta       = {}
+        self.unflushed   = set()
+        self.log_entries = 0
+        self.count       = self.base.count
+
+    def delete(self):
+        self.objectStorage.deleteObject([self.base_name, self.log_name])
+        self.base        = CatalogBase(None, self.base_name)
+        self.delta       = {}
+        self.unflushed   = set()
+        self.log_entries = 0
+        self.count       = 0
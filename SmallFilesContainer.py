@@ -1,23 +1,50 @@
 from VirtualBigFile import *
+from SmallFilesCatalog import SmallFilesCatalog
 import threading
 import atexit
 
 class SmallFilesContainer:
-    def __init__(self, name = "SmallFiles.bin", blocksize=0):
-        self.virtualBigFile = VirtualBigFile(name=name, blocksize=blocksize)
-        self.files          = {}
+    def __init__(self, name = "SmallFiles.bin", blocksize=0, storage=None):
+        # storage: MockObjectStorage of the container's objects, default getStorage()
+        self.objectStorage  = storage if storage is not None else getStorage()
+        self.virtualBigFile = VirtualBigFile(name=name, blocksize=blocksize, storage=self.objectStorage)
+        # file name --> [partition, start, end, is_str], memory mapped and updated incrementally
+        self.files          = SmallFilesCatalog(self.objectStorage, name)
+        self.new_index      = False
         num_partitions      = self.virtualBigFile.num_partitions()
-        if num_partitions > 0:
-            indexes = self.virtualBigFile.readPartition(num_partitions-1)
-            indexes = MockObjectStorage.convertBytes2Str(indexes,[tuple])
+        if num_partitions > 0 and not self.files.exists():
+            # container of an older version: its catalog is the rows name,partition,start,end,type appended after the files
+            indexes = SmallFilesContainer.__legacyCatalog__(self.virtualBigFile)
+            assert indexes is not None, "Catalog of {} is missing".format(name)
             for row in indexes:
-                self.files[row[0]] = [int(col) for col in row[1:]]
-        self.new_index      = False
+                self.files[row[0]] = row[1:]
+            self.files.merge()
         self.last_created   = ""
         self.lock           = threading.Lock()
+        self.compact_lock   = threading.Lock() # one compaction at a time
+        self.version        = 0                # changes when flushed partitions are released or deleted
         atexit.register(self.flush)
         return
     
+    def __legacyCatalog__(virtualBigFile):
+        # rows of the catalog of an older version, None when the container has none: the catalog starts at a partition
+        # after the last partition with files, so the last partitions are joined until all of them are catalog rows
+        # pointing to the partitions before them, and the last files point to the partition right before them
+        data = b''
+        for first in range(virtualBigFile.num_partitions()-1, 0, -1):
+            data = bytes(virtualBigFile.readPartition(first)) + data
+            try:
+                rows = MockObjectStorage.convertBytes2Str(data,[tuple])
+                rows = [[row[0]] + [int(col) for col in row[1:]] for row in rows]
+            except (ValueError, TypeError, IndexError):
+                continue
+            if len(rows) < 1 or any([len(row) != 5 or not (0 <= row[1] < first and 0 <= row[2] <= row[3] and row[4] in (0,1))
+                                     for row in rows]):
+                continue
+            if max([row[1] for row in rows]) == first-1:
+                return rows
+        return None
+
     def __enter__(self):
         return self
     
@@ -30,12 +57,13 @@ class SmallFilesContainer:
             self.lock.acquire()
         if self.new_index:
             if len(self.files) < 1:
-                self.virtualBigFile.delete()
-            else:
-                self.virtualBigFile.writeAppendix()
-                indexes = [','.join([key] + [str(v) for v in values]) for key,values in self.files.items()]
-                self.virtualBigFile.append(indexes)            
+                self.__invalidateFlushed__(self.virtualBigFile.delete)
+                self.files.delete()
             self.virtualBigFile.flush(objectStorageFlush)
+            # only the changed catalog records are written, after the partitions they point to
+            self.files.flush()
+            if objectStorageFlush:
+                self.objectStorage.flush([self.files.base_name])
             self.new_index      = False
             self.last_created   = ""
         if useLock:
@@ -43,7 +71,11 @@ class SmallFilesContainer:
         return
         
     def readFile(self,name,type_=None, useLock=True):
+        '''Files of flushed partitions are read without the lock, only files in the appendix wait for writers'''
         if useLock:
+            file_data, file_rec = self.__readFlushed__(name)
+            if file_rec is not None:
+                return SmallFilesContainer.__convertFile__(file_data,file_rec,type_)
             self.lock.acquire()
         ret = None
         while name in self.files:
@@ -54,18 +86,80 @@ class SmallFilesContainer:
             else:
                 partition = self.virtualBigFile.readPartition(ind_partition)
             file_data     = partition[file_rec[1]:file_rec[2]]
-            if type_ is None:
-                type_    = file_rec[3]
-            if isinstance(type_,bool) or isinstance(type_,int) and abs(type_) <= 1:
-                if not type_:
-                    ret = file_data
-                    break
-                type_ = [str]
-            ret = MockObjectStorage.convertBytes2Str(file_data,type_)
+            ret = SmallFilesContainer.__convertFile__(file_data,file_rec,type_)
             break
         if useLock:
             self.lock.release()
         return ret    
+
+    def readFiles(self, names, type_=None):
+        '''Reads many files at once: the partitions are read concurrently, each one once, and sliced for all its files
+        Returns a list in the order of names with None for missing files, files read as bytes are memoryview slices'''
+        ret         = [None]*len(names)
+        version     = self.version
+        num_flushed = len(self.virtualBigFile.index)
+        groups      = {} # flushed partition --> [(position in names, record)]
+        locked      = [] # positions of files that need the lock, files of the appendix
+        for pos, name in enumerate(names):
+            file_rec = self.files.get(name)
+            if file_rec is None:
+                continue
+            if version % 2 or file_rec[0] >= num_flushed:
+                locked.append(pos)
+            else:
+                groups.setdefault(file_rec[0],[]).append((pos,file_rec))
+        def readPartition(ind_partition):
+            try:
+                index = self.virtualBigFile.index
+                return self.virtualBigFile.readBuffers(index.start(ind_partition),index.end(ind_partition))[0]
+            except Exception:
+                # released or deleted meanwhile
+                return None
+        partitions = list(getReadPool().map(readPartition,list(groups)))
+        for group, partition in zip(groups.values(), partitions):
+            if partition is None or version != self.version:
+                locked.extend(pos for pos,_ in group)
+                continue
+            for pos, file_rec in group:
+                ret[pos] = SmallFilesContainer.__convertFile__(partition[file_rec[1]:file_rec[2]],file_rec,type_)
+        if len(locked) > 0:
+            self.lock.acquire()
+            for pos in locked:
+                ret[pos] = self.readFile(names[pos],type_,useLock=False)
+            self.lock.release()
+        return ret
+
+    def __readFlushed__(self, name):
+        # lock free read: (data, record) of a file in a flushed partition, (None, None) when the lock is needed
+        # flushed partitions never change, they are only released or reused after self.version changed
+        version  = self.version
+        file_rec = self.files.get(name)
+        if version % 2 or file_rec is None or file_rec[0] >= len(self.virtualBigFile.index):
+            return None, None
+        try:
+            start     = self.virtualBigFile.index.start(file_rec[0])
+            file_data = self.virtualBigFile.readData(start + file_rec[1], start + file_rec[2])
+        except Exception:
+            # the partition was released or deleted meanwhile, the locked read finds where the file is now
+            return None, None
+        if version != self.version:
+            return None, None
+        return file_data if file_data is not None else b'', file_rec
+
+    def __convertFile__(file_data, file_rec, type_):
+        if type_ is None:
+            type_    = file_rec[3]
+        if isinstance(type_,bool) or isinstance(type_,int) and abs(type_) <= 1:
+            if not type_:
+                return file_data
+            type_ = [str]
+        return MockObjectStorage.convertBytes2Str(file_data,type_)
+
+    def __invalidateFlushed__(self, release):
+        # seqlock for lock free readers: odd version while flushed partitions are released or deleted
+        self.version += 1
+        release()
+        self.version += 1
     
     def appendData(self, name, data, useLock=True):
         if useLock:
@@ -78,6 +172,41 @@ class SmallFilesContainer:
             self.lock.release()
         return
     
+    def appendMany(self, datas, useLock=True):
+        '''Appends many files at once: datas is {name: data}
+        New files are packed together and written into the appendix with one append per partition'''
+        if useLock:
+            self.lock.acquire()
+        chunk        = []
+        len_appendix = len(self.virtualBigFile.appendix)
+        for name, data in datas.items():
+            if name in self.files:
+                self.virtualBigFile.append(b''.join(chunk))
+                chunk = []
+                self.appendExistingFile(name=name,data=data,useLock=False)
+                len_appendix = len(self.virtualBigFile.appendix)
+                continue
+            is_str = int(isinstance(data,list) or isinstance(data,str))
+            if is_str:
+                data = MockObjectStorage.convertStr2Bytes(data)
+            length = len(data)
+            assert length <= self.virtualBigFile.blocksize
+            if len_appendix + length > self.virtualBigFile.blocksize:
+                self.virtualBigFile.append(b''.join(chunk))
+                chunk = []
+                self.virtualBigFile.writeAppendix()
+                len_appendix = 0
+            # the appendix is always the partition after the flushed ones
+            self.files[name]  = [len(self.virtualBigFile.index),len_appendix,len_appendix + length,is_str]
+            self.last_created = name
+            chunk.append(data)
+            len_appendix += length
+        self.virtualBigFile.append(b''.join(chunk))
+        self.new_index = True
+        if useLock:
+            self.lock.release()
+        return
+
     def appendExistingFile(self, name, data, useLock=True):
         if useLock:
             self.lock.acquire()
@@ -87,21 +216,26 @@ class SmallFilesContainer:
             existing_str_type = file_rec[3]
             if existing_str_type:
                 data = MockObjectStorage.convertStr2Bytes(data)
-            if name == self.last_created:
-                # try to append new data into existing appendix without writing into the disk
-                length       = len(data)
-                appendix     = self.virtualBigFile.appendix
-                len_appendix = len(appendix)
+            appendix     = self.virtualBigFile.appendix
+            len_appendix = len(appendix)
+            if file_rec[0] == len(self.virtualBigFile.index) and file_rec[2] == len_appendix:
+                # the file is the last one of the appendix: appending in place without copying it
+                length = len(data)
                 if len_appendix + length <= self.virtualBigFile.blocksize:
                     self.virtualBigFile.append(data)
                     file_rec[2] += length
+                    self.files[name] = file_rec
+                    self.new_index   = True
                     break
                 old_start, old_end = file_rec[1], file_rec[2]
-                old_data = appendix[old_start:old_end]
-                self.virtualBigFile.appendix = appendix[:old_start]
+                old_data = bytes(appendix[old_start:old_end])
+                # truncating in place
+                del appendix[old_start:]
             else:
-                old_data = self.readFile(name,is_str=False)
+                old_data = self.readFile(name,False,useLock=False)
+            # moving the file to the end of the appendix once, next appends to it are in place
             self.createNewFile(name,old_data + data,existing_str_type,useLock=False)
+            self.last_created = name
             break
         if useLock:
             self.lock.release()
@@ -141,9 +275,9 @@ class SmallFilesContainer:
     def deleteAllFiles(self, useLock=True):
         if useLock:
             self.lock.acquire()
-        self.files        = {}
+        self.files.delete()
         self.last_created = ""
-        self.virtualBigFile.delete()
+        self.__invalidateFlushed__(self.virtualBigFile.delete)
         self.new_index = True
         if useLock:
             self.lock.release()
@@ -171,11 +305,56 @@ class SmallFilesContainer:
             self.lock.release()
         return ret
     
-    def getFileNames(self, useLock=True):
-        if useLock:
-            self.lock.acquire()
-        ret = list(self.files.keys())
-        if useLock:
+    def compact(self, live_ratio=0.5):
+        '''Garbage collection: files of flushed partitions with less than live_ratio live bytes are moved into new
+        partitions, then the old partitions are released and the catalog is merged into a dense base.
+        The partitions are read without the lock, files changed meanwhile are not moved.
+        Returns the number of released partitions'''
+        self.compact_lock.acquire()
+        # live bytes and files of each flushed partition
+        self.lock.acquire()
+        version     = self.version
+        num_flushed = len(self.virtualBigFile.index)
+        live_bytes  = [0]*num_flushed
+        live_files  = [[] for _ in range(num_flushed)]
+        for name, file_rec in self.files.items():
+            if file_rec[0] < num_flushed:
+                live_bytes[file_rec[0]] += file_rec[2] - file_rec[1]
+                live_files[file_rec[0]].append((name,file_rec))
+        self.lock.release()
+        # partitions released by an earlier compaction have no live bytes either
+        released = set(self.virtualBigFile.releasedPartitions())
+        sparse   = [ind for ind in range(num_flushed)
+                    if ind not in released and live_bytes[ind] < live_ratio*self.virtualBigFile.index.size(ind)]
+        # copying the live files of the sparse partitions, flushed partitions do not change
+        moved = []
+        for ind in sparse:
+            if len(live_files[ind]) < 1:
+                continue
+            partition = self.virtualBigFile.readPartition(ind)
+            for name, file_rec in live_files[ind]:
+                moved.append((name,file_rec,partition[file_rec[1]:file_rec[2]]))
+        self.lock.acquire()
+        if self.version != version:
+            # the flushed partitions were deleted meanwhile, their numbers may belong to new partitions now
             self.lock.release()
-        return ret
+            self.compact_lock.release()
+            return 0
+        for name, file_rec, data in moved:
+            if self.files.get(name) != file_rec:
+                # deleted or rewritten after the copy, it does not point into the sparse partition anymore
+                continue
+            self.createNewFile(name,data,file_rec[3],useLock=False)
+        # the new locations are on disk before the old partitions are released
+        self.flush(objectStorageFlush=True, useLock=False)
+        self.files.merge()
+        self.objectStorage.flush([self.files.base_name])
+        self.__invalidateFlushed__(lambda: self.virtualBigFile.releasePartitions(sparse))
+        self.lock.release()
+        self.compact_lock.release()
+        return len(sparse)
+
+    def getFileNames(self, useLock=True):
+        # the catalog iterates over a snapshot, no lock is needed
+        return list(self.files.keys())
     
@@ -1,53 +1,131 @@
 from MockObjectStorage import MockObjectStorage
-from bisect import bisect_left
+from ColumnarFormat import ColumnarFormat
+from Compression import Compression
+from PartitionIndex import PartitionIndex
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+import codecs
 import atexit
+import os
+import threading
 
 KB = 2**10
 MB = KB*KB
 GB = MB*KB
 EOL = b'\n' # end of line
+FORMATS = ("csv", "columnar")
 
+# storage shared by all virtual files which are not given their own
 objectStorage = MockObjectStorage()
 
+# storage of the virtual files opened by a thread without one, for example the storage of the job MapReduceEngine runs
+threadStorage = threading.local()
+
+def getStorage():
+    storage = getattr(threadStorage,"storage",None)
+    return storage if storage is not None else objectStorage
+
+def setStorage(storage):
+    # None returns this thread to the shared objectStorage
+    threadStorage.storage = storage
+
+# bounded pool of threads fetching and decompressing partitions of all virtual files in parallel
+readPool = None
+
+def getReadPool():
+    global readPool
+    if readPool is None:
+        readPool = ThreadPoolExecutor(max_workers=VirtualBigFile.readThreads, thread_name_prefix="VirtualBigFileRead")
+    return readPool
+
+def resetReadPool():
+    # a forked child does not have the threads of the parent's pool
+    global readPool
+    readPool = None
+
+if hasattr(os,"register_at_fork"):
+    os.register_at_fork(after_in_child=resetReadPool)
+
+# virtual files with appended data that was not flushed yet
+# one exit hook flushes them all, clean files are not kept alive by the exit hooks
+# it runs before the exit hook of MockObjectStorage writing the storages, so the flushed partitions reach the disk
+dirtyFiles = set()
+
+def flushDirtyFiles():
+    for bigFile in list(dirtyFiles):
+        bigFile.flush()
+
+atexit.register(flushDirtyFiles)
+
 class VirtualBigFile:
     defaultBlockSize = 1*MB
+    readThreads      = 8
     
-    def __init__(self, name:str, blocksize=0, verboseOpen=0):
+    def __init__(self, name:str, blocksize=0, verboseOpen=0, format_=None, codec=None, readAhead=0, indexView=None, storage=None):
+        '''format_: "csv" text rows (default for new files) or "columnar" typed binary blocks, see ColumnarFormat
+        codec: compression of each partition, "none" (default for new files) or one of Compression.available()
+        readAhead: for sequential scans, each read pulls the next readAhead partitions into cache in the background
+        indexView: the index object when it was already read, see openFiles
+        storage: MockObjectStorage of the file's objects, default getStorage()
+        An existing file keeps the format and codec recorded in its index'''
         assert len(name) > 0
         splited_name = name.split('.')
         assert len(splited_name) > 1, "File name must have an extension"
+        self.objectStorage   = storage if storage is not None else getStorage()
         self.name            = '.'.join(splited_name[:-1])
         self.extension       = "." + splited_name[-1]
-        self.index_name      = name + ".index.csv"
+        self.index_name      = name + ".index.bin"
         self.blocksize       = blocksize if blocksize > 0 else VirtualBigFile.defaultBlockSize
-        self.appendix        = bytes()
-        self.physicalsize    = 0
-        self.files           = []
-        self.sizes           = []
-        self.first_locations = []
-        self.last_locations  = []
+        self.readAhead       = readAhead
+        self.appendix        = bytearray() # grows in place, appending is linear in the appended bytes
         self.type_           = None
-        str_index            = objectStorage.readObject(self.index_name,[tuple])
-        if str_index is None:
-            self.next_file_id = 0
-        else:
-            for csv_row in str_index:
-                filename, size = csv_row[0], int(csv_row[1])
-                self.files.append(filename)
-                self.sizes.append(size)
-                self.first_locations.append(self.physicalsize)
-                self.physicalsize += size
-                self.last_locations.append(self.physicalsize-1)
-            last_name   = self.files[-1].split('.')
-            # for example: last_name=['file' 'name' '999' 'extension'] --> last_name[-2] == '999'
-            last_number = int(last_name[-2])
-            self.next_file_id = last_number + 1
-        self.old_index       = self.physicalsize > 0
-        self.new_index       = False
+        self.format          = None
+        self.codec           = None
+        self.schema          = None # [(column name, type code)] of a columnar file
+        self.block_offsets   = []   # start of each columnar block in appendix
+        # end locations of the flushed partitions, partition i is the object partitionName(i)
+        self.index           = PartitionIndex(self.objectStorage, self.index_name, indexView)
+        if not self.index.exists():
+            self.__migrateIndex__(name + ".index.csv")
+        for row in self.index.metadata:
+            if row[0] == "#format":
+                # header row of non csv files: #format,columnar,name:type,...
+                self.format = row[1]
+                self.schema = ColumnarFormat.str2Schema(row[2:]) if len(row) > 2 else None
+            elif row[0] == "#codec":
+                # header row of compressed files: #codec,zlib
+                self.codec = row[1]
+        self.physicalsize    = self.index.totalSize()
+        if self.format is None:
+            self.format = format_ if format_ is not None else "csv"
+        assert self.format in FORMATS, "Unknown format: {}".format(self.format)
+        assert format_ is None or format_ == self.format, "{} has format {}".format(name,self.format)
+        if self.codec is None:
+            self.codec = codec if codec is not None else "none"
+        Compression.check(self.codec)
+        assert codec is None or codec == self.codec, "{} has codec {}".format(name,self.codec)
         if verboseOpen>1 or verboseOpen==1 and self.physicalsize:
             print("VirtualBigFile.open({}) size={}".format(name,self.physicalsize))
-        atexit.register(self.flush)
     
+    def __migrateIndex__(self, csv_name):
+        # one time conversion of a <name>.index.csv written by older versions into the binary index
+        str_index = self.objectStorage.readObject(csv_name,[tuple])
+        if str_index is None:
+            return
+        for csv_row in str_index:
+            if csv_row[0].startswith('#'):
+                self.index.metadata.append(list(csv_row))
+                continue
+            assert csv_row[0] == self.partitionName(len(self.index)), "Unexpected partition {} in {}".format(csv_row[0],csv_name)
+            self.index.append(int(csv_row[1]))
+        if len(self.index) > 0:
+            self.index.flush()
+        self.objectStorage.deleteObject(csv_name)
+
+    def partitionName(self, indPartition):
+        # for example: file.name.0000999.extension
+        return self.name + ".{:07d}".format(indPartition) + self.extension
+
     def __enter__(self):
         return self
 
@@ -55,27 +133,73 @@ class VirtualBigFile:
         self.flush()
             
     def num_partitions(self):
-        return len(self.files) + int(len(self.appendix) > 0)
+        return len(self.index) + int(len(self.appendix) > 0)
     
     def append(self,data):
+        if len(data) < 1:
+            # nothing to append, for example a reduce thread that got an empty partition
+            return
+        dirtyFiles.add(self)
+        if self.format == "columnar":
+            # DataFrame or list of tuples --> one binary block
+            if self.schema is None:
+                self.schema = ColumnarFormat.inferSchema(data)
+            self.block_offsets.append(len(self.appendix))
+            self.appendix += ColumnarFormat.encodeBlock(data,self.schema)
+            return
         is_list = isinstance(data,list)
         if isinstance(data,str) or is_list and (isinstance(data[0],str) or isinstance(data[0],tuple) and isinstance(data[0][0],str)):
             self.type_ = str
-            self.appendix += bytearray(MockObjectStorage.convertStr2Bytes(data))
+            self.appendix += MockObjectStorage.convertStr2Bytes(data)
         elif is_list:
             for d in data:
-                self.appendix += bytearray(d)
+                self.appendix += d
         else:
-            self.appendix += bytearray(data)
+            self.appendix += data
 
     def readPartition(self, indPartition, type_=None):
-        if indPartition < 0 or indPartition > len(self.files):
+        if indPartition < 0 or indPartition > len(self.index):
             return None
-        if indPartition < len(self.files):
-            return self.readData(self.first_locations[indPartition],self.last_locations[indPartition]+1, type_)
+        if indPartition < len(self.index):
+            return self.readData(self.index.start(indPartition),self.index.end(indPartition), type_)
         return self.readData(self.physicalsize,self.physicalsize + len(self.appendix), type_)
     
     def readData(self,indStart=None,indEnd=None, type_=None):
+        buffers = self.readBuffers(indStart,indEnd)
+        if buffers is None:
+            return None
+        if len(buffers) == 1 and isinstance(buffers[0].obj,bytes) and len(buffers[0]) == len(buffers[0].obj):
+            # whole cached partition --> no need to copy it
+            res = buffers[0].obj
+        else:
+            # single copy of the exact range
+            res = b''.join(buffers)
+        if type_ is None:
+            return res
+        if self.format == "columnar":
+            return VirtualBigFile.columnar2Str(res,type_)
+        return MockObjectStorage.convertBytes2Str(res,type_)
+
+    def columnar2Str(bytes_, type_):
+        # columnar blocks --> the same results convertBytes2Str gives for text rows
+        tuples = ColumnarFormat.toTuples(bytes_)
+        if type_ == [tuple]:
+            return tuples
+        rows = [','.join(str(value) for value in row) for row in tuples]
+        if type_ == [str]:
+            return rows
+        assert type_ == str
+        return ''.join(row + '\n' for row in rows)
+
+    def readTable(self):
+        '''Whole columnar file as a DataFrame, numeric columns are not parsed from text'''
+        assert self.format == "columnar", "readTable needs a columnar file"
+        res = self.readData()
+        return ColumnarFormat.toDataFrame(res if res is not None else b'', self.schema or [])
+
+    def readBuffers(self,indStart=None,indEnd=None):
+        # zero copy read: list of memoryviews covering exactly [indStart,indEnd)
+        # flushed partitions are memory mapped or viewed in cache, the appendix is copied because it keeps growing
         totalsize = self.physicalsize + len(self.appendix)
         if indStart is None:
             indStart = 0
@@ -87,47 +211,137 @@ class VirtualBigFile:
             indEnd += totalsize
         if indStart >= indEnd or indStart < 0 or indEnd > totalsize:
             return None
-        indFirstBlock = bisect_left(self.last_locations, indStart)
-        indLastBlock  = bisect_left(self.last_locations, indEnd-1)
-        if indFirstBlock < len(self.files):
-            res             = objectStorage.readObject(self.files[indFirstBlock:min(indLastBlock+1,len(self.files))])
-            indStartOfBlock = self.first_locations[indFirstBlock]
-            indEndOfBlock   = self.totalsize if indLastBlock == len(self.files) else (self.last_locations[indLastBlock]+1)
+        indFirstBlock = self.index.locate(indStart)
+        indLastBlock  = self.index.locate(indEnd-1)
+        indBlocks     = range(indFirstBlock,min(indLastBlock+1,len(self.index)))
+        filenames     = [self.partitionName(indBlock) for indBlock in indBlocks]
+        if len(indBlocks) > 0:
+            self.__readAhead__(indBlocks[-1] + 1, self.readAhead, len(self.index))
+        if len(filenames) > 1:
+            # fetching (and decompressing) the partitions concurrently, not one latency after another
+            views = list(getReadPool().map(self.__fetchPartition__,filenames,[True]*len(filenames)))
         else:
-            res             = []
-            indStartOfBlock = self.physicalsize
-            indEndOfBlock   = totalsize
-        if indLastBlock == len(self.files):
-            res.append(self.appendix)
-        res = res[0] if len(res) == 1 else b''.join(res)
-        if indStart > indStartOfBlock or indEnd < indEndOfBlock:
-            res = res[(indStart-indStartOfBlock):(indEnd-indStartOfBlock)]
-        if type_ is None:
-            return res
-        return MockObjectStorage.convertBytes2Str(res,type_)
+            views = [self.__fetchPartition__(filename) for filename in filenames]
+        buffers       = []
+        for indBlock, view in zip(indBlocks,views):
+            indStartOfBlock = self.index.start(indBlock)
+            indEndOfBlock   = self.index.end(indBlock)
+            if indStart > indStartOfBlock or indEnd < indEndOfBlock:
+                view = view[max(indStart-indStartOfBlock,0):(min(indEnd,indEndOfBlock)-indStartOfBlock)]
+            buffers.append(view)
+        if indEnd > self.physicalsize:
+            buffers.append(memoryview(bytes(self.appendix[max(indStart-self.physicalsize,0):(indEnd-self.physicalsize)])))
+        return buffers
 
-    def flush(self, objectStorageFlush=False):
-        self.writeAppendix()
-        if self.new_index:
-            if self.old_index:
-                objectStorage.deleteObject(self.index_name)
-            else:
-                self.old_index = True
-            # rebuilding index file on disk
-            str_index = [name + ',' + str(size) for name,size in zip(self.files,self.sizes)]
-            objectStorage.createObject(self.index_name,str_index)
-            self.new_index = False
+    def __fetchPartition__(self, filename, prefetch=False):
+        # uncompressed content of a flushed partition
+        view = self.objectStorage.mapObject(filename, prefetch=prefetch)
+        assert view is not None, "Partition {} was released or lost".format(filename)
+        if self.codec == "none":
+            return view
+        return memoryview(Compression.decompress(self.codec,view))
+
+    def __readAhead__(self, indPartition, num_partitions, num_files):
+        # partitions indPartition... are expected to be read next
+        if num_partitions > 0 and indPartition < num_files:
+            self.objectStorage.prefetchObject([self.partitionName(ind) for ind in range(indPartition,min(indPartition + num_partitions,num_files))])
+
+    def iterRecords(self, type_=str, batch_size=0, prefetch=True, readAhead=None):
+        '''Generator over the records of the file, one partition in memory at a time
+        type_: str yields each line, tuple yields the comma separated fields of each line (typed values of a columnar file)
+        batch_size: yields lists of up to batch_size records instead of single records
+        prefetch: a background thread fetches the next partition while the current one is consumed
+        readAhead: further partitions pulled into cache in the background (default self.readAhead)
+        A record that straddles a partition boundary is joined from both partitions'''
+        assert type_ in (str, tuple)
+        readAhead = readAhead if readAhead is not None else self.readAhead
+        # snapshot, appending while iterating does not change the iterated data
+        num_files = len(self.index)
+        appendix  = bytes(self.appendix)
+        def fetch(indPartition):
+            if indPartition < num_files:
+                return self.__fetchPartition__(self.partitionName(indPartition), prefetch=prefetch)
+            return memoryview(appendix)
+        num_partitions = num_files + int(len(appendix) > 0)
+        pool     = ThreadPoolExecutor(max_workers=1) if prefetch and num_partitions > 1 else None
+        leftover = ''
+        batch    = []
+        try:
+            next_partition = pool.submit(fetch,0) if pool is not None else None
+            for indPartition in range(num_partitions):
+                if pool is not None:
+                    partition = next_partition.result()
+                    if indPartition + 1 < num_partitions:
+                        next_partition = pool.submit(fetch,indPartition + 1)
+                else:
+                    partition = fetch(indPartition)
+                # the next partition is already being fetched by the prefetch thread
+                self.__readAhead__(indPartition + 1 + int(pool is not None), readAhead, num_files)
+                if self.format == "columnar":
+                    # partitions hold whole blocks, no record straddles a boundary
+                    records = ColumnarFormat.toTuples(partition)
+                    if type_ == str:
+                        records = [','.join(str(value) for value in row) for row in records]
+                else:
+                    lines    = (leftover + codecs.decode(partition,'ASCII')).split('\n')
+                    # the last piece has no end-of-line yet, it is continued by the next partition
+                    leftover = lines.pop()
+                    records  = [line[:-1] if line.endswith('\r') else line for line in lines]
+                    if type_ == tuple:
+                        records = [tuple(record.split(',')) for record in records]
+                if batch_size < 1:
+                    yield from records
+                    continue
+                batch.extend(records)
+                if len(batch) >= batch_size:
+                    num_full = len(batch) - len(batch) % batch_size
+                    for ind in range(0,num_full,batch_size):
+                        yield batch[ind:(ind + batch_size)]
+                    batch = batch[num_full:]
+            if len(leftover) > 0:
+                # last record without end-of-line
+                record = tuple(leftover.split(',')) if type_ == tuple else leftover
+                if batch_size < 1:
+                    yield record
+                else:
+                    batch.append(record)
+            if len(batch) > 0:
+                yield batch
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True)
+
+    def flush(self, objectStorageFlush=False, batch=None):
+        # batch: list collecting (name, data) of new objects instead of creating them now, see flushFiles
+        self.writeAppendix(batch)
+        if len(self.index) > 0:
+            # header rows only for files that are not plain csv
+            metadata = []
+            if self.format != "csv":
+                metadata.append(["#format",self.format] + ColumnarFormat.schema2Str(self.schema or []))
+            if self.codec != "none":
+                metadata.append(["#codec",self.codec])
+            self.index.metadata = metadata
+            # only the end locations of new partitions are appended to the index on disk
+            self.index.flush(batch)
+        dirtyFiles.discard(self)
         if objectStorageFlush:
-            objectStorage.flush([self.index_name] + self.files)
+            self.objectStorage.flush([self.index_name] + [self.partitionName(ind) for ind in range(len(self.index))])
             
-    def writeAppendix(self):
+    def writeAppendix(self, batch=None):
         len_appendix = len(self.appendix)
         if len_appendix < 1:
             return
-        self.new_index = True
         indStart = 0
+        boundaries = self.block_offsets + [len_appendix]
         while indStart + self.blocksize < len_appendix:
-            if self.type_ is None or self.type_ != str:
+            if self.format == "columnar":
+                # partitions hold whole blocks: the last block boundary that fits, or the end of an oversized block
+                ind = bisect_right(boundaries, indStart + self.blocksize) - 1
+                if boundaries[ind] <= indStart:
+                    ind = bisect_right(boundaries, indStart)
+                filesize = boundaries[ind] - indStart
+            elif self.type_ is None or self.type_ != str:
                 filesize = self.blocksize
             else:
                 last_EOL_pos = self.appendix.rfind(EOL,indStart,indStart + self.blocksize)
@@ -136,51 +350,117 @@ class VirtualBigFile:
                     if last_EOL_pos < 0:
                         # did not find any end-of-line till the end of appendix
                         break                        
-                filesize = last_EOL_pos + 1
-            self.__writePartition__(indStart,filesize)
+                filesize = last_EOL_pos + 1 - indStart
+            self.__writePartition__(indStart,filesize,batch)
             indStart += filesize
         if indStart < len_appendix:
             # writing the rest of last partition
-            self.__writePartition__(indStart,len_appendix-indStart)
-        self.appendix = bytearray()
+            self.__writePartition__(indStart,len_appendix-indStart,batch)
+        self.appendix      = bytearray()
+        self.block_offsets = []
         
-    def __writePartition__(self,indStart,blocksize):
-        filename = self.name + ".{:07d}".format(self.next_file_id) + self.extension
-        objectStorage.createObject(filename, self.appendix[indStart:(indStart + blocksize)])
-        self.files.append(filename)
-        self.sizes.append(blocksize)
-        self.first_locations.append(self.physicalsize)
+    def __writePartition__(self,indStart,blocksize,batch=None):
+        filename = self.partitionName(len(self.index))
+        data     = self.appendix[indStart:(indStart + blocksize)]
+        if self.codec != "none":
+            # the index keeps the uncompressed size, positions in the file do not depend on the codec
+            data = Compression.compress(self.codec,bytes(data))
+        if batch is not None:
+            batch.append((filename,data))
+        else:
+            self.objectStorage.createObject(filename, data)
+        self.index.append(blocksize)
         self.physicalsize += blocksize
-        self.last_locations.append(self.physicalsize-1)
-        self.next_file_id += 1
         
-    def delete(self):
-        self.appendix = bytearray()
-        if self.physicalsize < 1:
+    def delete(self, batch=None):
+        # batch: list collecting the names of the deleted objects instead of deleting them now, see deleteFiles
+        self.appendix      = bytearray()
+        self.block_offsets = []
+        self.schema        = None
+        dirtyFiles.discard(self)
+        if len(self.index) < 1 and not self.index.exists():
             return
-        objectStorage.deleteObject([self.index_name] + self.files)
+        names = [self.partitionName(ind) for ind in range(len(self.index))]
+        if batch is not None:
+            batch.extend(names)
+        else:
+            self.objectStorage.deleteObject(names)
+        self.index.delete(batch)
         self.physicalsize    = 0
-        self.files           = []
-        self.sizes           = []
-        self.first_locations = []
-        self.last_locations  = []
-        self.next_file_id    = 0
-
-    def flushFiles(filenames, objectStorageFlush=False):
-        for f in filenames:
-            bigFile = VirtualBigFile(f,verboseOpen=1)
-            if bigFile.physicalsize < 1:
-                continue
-            bigFile.flush(objectStorageFlush=objectStorageFlush)
-            
-    def deleteFiles(filenames):
-        for f in filenames:
-            bigFile = VirtualBigFile(f,verboseOpen=1)
-            if bigFile.physicalsize < 1:
-                continue
-            bigFile.delete()
-            pass
-        pass
+
+    def releasePartitions(self, indPartitions):
+        '''Deletes the objects of flushed partitions whose data is not needed anymore, for example after compacting
+        a SmallFilesContainer. Their locations stay in the index and reading them fails'''
+        self.objectStorage.deleteObject([self.partitionName(ind) for ind in indPartitions if ind < len(self.index)])
+
+    def releasedPartitions(self):
+        # flushed partitions whose objects were released (or lost)
+        names = set(self.objectStorage.listObjects(self.name + "."))
+        return [ind for ind in range(len(self.index)) if self.partitionName(ind) not in names]
+
+    def fileSize(name, storage=None):
+        # physical size of a virtual file from its index, without opening it
+        storage = storage if storage is not None else getStorage()
+        size    = PartitionIndex.totalSizeOf(storage, name + ".index.bin")
+        if size is not None:
+            return size
+        # index of an older version, not migrated yet
+        str_index = storage.readObject(name + ".index.csv",[tuple])
+        if str_index is None:
+            return 0
+        return sum(int(csv_row[1]) for csv_row in str_index if not csv_row[0].startswith('#'))
+
+    def openFiles(filenames, **kwargs):
+        '''Opens many virtual files at once, their indexes are read concurrently
+        kwargs are passed to each VirtualBigFile'''
+        storage = kwargs.get("storage") or getStorage()
+        views   = getReadPool().map(lambda f: storage.mapObject(f + ".index.bin"), filenames)
+        kwargs  = dict(kwargs, storage=storage)
+        return [VirtualBigFile(f, indexView=view if view is not None else memoryview(b''), **kwargs)
+                for f, view in zip(filenames,views)]
+
+    def writeFiles(datas, **kwargs):
+        '''Creates or replaces many virtual files at once: datas is {filename: data to append}
+        Returns the flushed VirtualBigFile objects'''
+        bigFiles = VirtualBigFile.openFiles(list(datas), **kwargs)
+        VirtualBigFile.deleteFiles(bigFiles)
+        for bigFile, data in zip(bigFiles, datas.values()):
+            bigFile.append(data)
+        VirtualBigFile.flushFiles(bigFiles)
+        return bigFiles
+
+    def flushFiles(filenames, objectStorageFlush=False, storage=None):
+        '''Flushes many virtual files (names or VirtualBigFile objects), all new objects of a storage are created with one call
+        storage: of the files given by name'''
+        batches = {} # storage --> [(name, data)]
+        names   = {} # storage --> names of the objects to flush
+        for bigFile in VirtualBigFile.__openMany__(filenames, storage):
+            bigFile.flush(batch=batches.setdefault(bigFile.objectStorage,[]))
+            if objectStorageFlush:
+                names.setdefault(bigFile.objectStorage,set()).add(bigFile.index_name)
+                names[bigFile.objectStorage].update(bigFile.partitionName(ind) for ind in range(len(bigFile.index)))
+        for fileStorage, batch in batches.items():
+            if len(batch) > 0:
+                fileStorage.createObject([name for name,_ in batch],[data for _,data in batch])
+        for fileStorage, flushed in names.items():
+            fileStorage.flush(flushed)
+
+    def deleteFiles(filenames, storage=None):
+        '''Deletes many virtual files (names or VirtualBigFile objects), all objects of a storage are deleted with one call
+        storage: of the files given by name'''
+        batches = {} # storage --> names of the objects to delete
+        for bigFile in VirtualBigFile.__openMany__(filenames, storage):
+            bigFile.delete(batch=batches.setdefault(bigFile.objectStorage,[]))
+        for fileStorage, batch in batches.items():
+            if len(batch) > 0:
+                fileStorage.deleteObject(batch)
+
+    def __openMany__(filenames, storage=None):
+        filenames = list(filenames)
+        opened    = [f for f in filenames if isinstance(f,VirtualBigFile)]
+        if len(opened) == len(filenames):
+            return opened
+        return opened + VirtualBigFile.openFiles([f for f in filenames if not isinstance(f,VirtualBigFile)], storage=storage)
     
     pass
 